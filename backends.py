@@ -0,0 +1,19 @@
+"""
+Import the libraries that only some modes use, such as textacy,
+phrasemachine and pyLDAvis, the first time they're needed instead of when a
+script starts.
+"""
+import importlib
+import warnings
+
+
+def import_backend(name):
+    """
+    Import a module by name, or return it if it's already imported.
+
+    gensim_engine turns warnings into errors, which would break libraries
+    that warn while they're imported, so warnings are ignored meanwhile.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return importlib.import_module(name)
@@ -0,0 +1,100 @@
+"""
+Benchmark CorpusReader.fetch_document_bigrams against the original
+implementation, which built a gensim Phrases object for every document and
+filtered bigrams using list lookups.
+
+Both implementations are run over the lemmas of the same documents, and
+their output is compared before timing them. Run it from the root of the
+repository:
+
+    python benchmarks/bigram_filtering.py input/early-years.csv input/running-a-school-audit.csv
+"""
+from __future__ import print_function
+import argparse
+import os
+import re
+import sys
+import time
+from collections import Counter
+from itertools import chain, repeat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gensim.models import Phrases
+from gensim.utils import lemmatize
+from corpus_building import CorpusReader, preprocess_unicode, stopwords_bytes, stopwords_unicode
+from model_io import load_documents
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('csv_files', metavar='CSV', nargs='+', help='Files containing "url" and "text" columns')
+parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='Number of times to time each implementation')
+
+
+def legacy_fetch_document_bigrams(document_lemmas, top_bigrams, stopwords, number_of_bigrams=100):
+    """
+    The original implementation of CorpusReader.fetch_document_bigrams, plus
+    the second filter applied by _phrases_in_raw_text_via_lemmatisation.
+    """
+    bigram = Phrases()
+    bigram.add_vocab([document_lemmas])
+    bigram_counter = Counter()
+
+    for key in bigram.vocab.keys():
+        if key not in stopwords:
+            if len(key.split("_")) > 1:
+                bigram_counter[key] += bigram.vocab[key]
+
+    bigram_iterators = [
+        repeat(bigram, bigram_count)
+        for bigram, bigram_count
+        in bigram_counter.most_common(number_of_bigrams)
+    ]
+    found_bigrams = list(chain(*bigram_iterators))
+    known_bigrams = [bigram for bigram in found_bigrams if bigram in top_bigrams]
+
+    return [bigram for bigram in known_bigrams if bigram in top_bigrams]
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    reader = CorpusReader(include_bigrams=True)
+    top_bigrams_list = list(reader.top_bigrams)
+    stopwords_list = list(stopwords_bytes())
+
+    for filename in args.csv_files:
+        documents = load_documents(filename)
+        print("{}: lemmatising {} documents".format(filename, len(documents)))
+        document_lemmas = [
+            lemmatize(preprocess_unicode(document['text'].decode('utf8')), allowed_tags=re.compile('(NN|JJ)'), stopwords=stopwords_unicode())
+            for document in documents
+        ]
+
+        legacy = [legacy_fetch_document_bigrams(lemmas, top_bigrams_list, stopwords_list) for lemmas in document_lemmas]
+        current = [reader.fetch_document_bigrams(lemmas) for lemmas in document_lemmas]
+
+        # Bigrams with equal counts can be ordered differently, so compare
+        # the bigrams of each document as a multiset.
+        differences = sum(1 for old, new in zip(legacy, current) if sorted(old) != sorted(new))
+
+        legacy_time = best_time(
+            lambda: [legacy_fetch_document_bigrams(lemmas, top_bigrams_list, stopwords_list) for lemmas in document_lemmas],
+            args.repeat
+        )
+        current_time = best_time(
+            lambda: [reader.fetch_document_bigrams(lemmas) for lemmas in document_lemmas],
+            args.repeat
+        )
+
+        print("  documents with different bigrams: {}".format(differences))
+        print("  original: {:.3f}s".format(legacy_time))
+        print("  current:  {:.3f}s".format(current_time))
+        print("  speed-up: {:.1f}x".format(legacy_time / current_time if current_time else float('inf')))
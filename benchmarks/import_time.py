@@ -0,0 +1,74 @@
+"""
+Time how long the pipeline's modules take to import, and check that they
+don't import the libraries that only some modes use.
+
+Each module is imported in a new Python process, several times, and the
+fastest time is reported. The script exits with an error if importing a
+module loads textacy, phrasemachine or pyLDAvis, or if it takes longer than
+--max-seconds. Run it from anywhere:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --max-seconds 2
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only imported when the mode that uses them is selected
+LAZY_BACKENDS = ['textacy', 'phrasemachine', 'pyLDAvis', 'spacy', 'nltk']
+
+MODULES = ['corpus_building', 'gensim_engine', 'tagging_server', 'train_lda']
+
+MEASURE = '''
+import json, sys, time
+started = time.time()
+import {module}
+elapsed = time.time() - started
+print(json.dumps(dict(seconds=elapsed, loaded=[name for name in {backends!r} if name in sys.modules])))
+'''
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('modules', metavar='MODULE', nargs='*', default=MODULES, help='Modules to import')
+parser.add_argument('--repeat', dest='repeat', type=int, default=5, help='Number of times to import each module')
+parser.add_argument('--max-seconds', dest='max_seconds', type=float, default=None, help='Fail if a module takes longer than this to import')
+
+
+def measure(module, repeat):
+    """
+    Return the fastest import time of a module in a new process, and the
+    lazily imported libraries it loaded.
+    """
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', MEASURE.format(module=module, backends=LAZY_BACKENDS)],
+            cwd=ROOT
+        )
+        result = json.loads(output.splitlines()[-1])
+        timings.append(result['seconds'])
+        loaded = result['loaded']
+    return min(timings), loaded
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        seconds, loaded = measure(module, args.repeat)
+        print("{:<20} {:>7.3f}s{}".format(module, seconds, "  loaded " + ", ".join(loaded) if loaded else ""))
+
+        if loaded:
+            failures.append(module)
+        elif args.max_seconds is not None and seconds > args.max_seconds:
+            failures.append(module)
+
+    if failures:
+        print("Too slow, or imported optional libraries: {}".format(", ".join(failures)))
+        sys.exit(1)
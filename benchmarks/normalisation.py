@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Check that preprocess_unicode gives exactly the same output as the original
+chain of textacy preprocess functions, and time both.
+
+Both are run over a set of awkward strings, the lines of the stopword files,
+and the documents of any CSV files given. The output must be equal and of the
+same type, since byte strings and unicode strings have their punctuation
+removed differently. Run it from the root of the repository:
+
+    python benchmarks/normalisation.py input/early-years.csv input/running-a-school-audit.csv
+
+The script exits with an error if any output differs.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from textacy import preprocess
+from corpus_building import preprocess_unicode
+from model_io import load_documents
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('csv_files', metavar='CSV', nargs='*', help='Files containing "url" and "text" columns')
+parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='Number of times to time each implementation')
+
+# Text where the replacements meet, or where transliteration matters
+AWKWARD_TEXTS = [
+    u'',
+    u'plain ascii text with nothing to remove',
+    u'Contact enquiries@education.gov.uk or call 0370 000 2288 ext. 123',
+    u'See https://www.gov.uk/guidance/school-funding?year=2016#section-2, or bit.ly/abc.',
+    u'www.gov.uk/x@y.com 1,234 5678 1 234 5678 (555)http://x.com 555 1234',
+    u'£1,500 €200 $30 ¥40 – 1.5m – 2016/17',
+    u'‘Café’ “résumé” naïve Æsop Straße ﬁnance',
+    u'emoji \U0001F600 and symbols © ® ™ ½ ¼',
+    u'+44 (0)20 7946 0000 or 020-7946-0000 x12',
+    u'numbers at the end 1,000.',
+    u'@ on its own, and a.b@c',
+]
+
+
+def textacy_preprocess_unicode(raw_text):
+    """
+    preprocess_unicode as it was first written.
+    """
+    raw_text = preprocess.transliterate_unicode(raw_text.lower())
+    raw_text = preprocess.replace_urls(raw_text, replace_with=u'')
+    raw_text = preprocess.replace_emails(raw_text, replace_with=u'')
+    raw_text = preprocess.replace_phone_numbers(raw_text, replace_with=u'')
+    raw_text = preprocess.replace_numbers(raw_text, replace_with=u'')
+    raw_text = preprocess.replace_currency_symbols(raw_text, replace_with=u'')
+    return raw_text
+
+
+def stopword_lines():
+    lines = []
+    for filename in glob.glob('stopwords/*.txt'):
+        with open(filename) as fileobj:
+            lines.extend(line.decode('utf8').strip() for line in fileobj)
+    return lines
+
+
+def differences(texts):
+    """
+    Return the texts that are normalised differently, with both outputs.
+    """
+    different = []
+    for text in texts:
+        expected = textacy_preprocess_unicode(text)
+        actual = preprocess_unicode(text)
+        if expected != actual or type(expected) != type(actual):
+            different.append((text, expected, actual))
+    return different
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def compare(name, texts, repeat):
+    different = differences(texts)
+    print("{}: {} texts, {} normalised differently".format(name, len(texts), len(different)))
+    for text, expected, actual in different[:10]:
+        print("  {!r}\n    textacy: {!r}\n    current: {!r}".format(text, expected, actual))
+
+    original_time = best_time(lambda: [textacy_preprocess_unicode(text) for text in texts], repeat)
+    current_time = best_time(lambda: [preprocess_unicode(text) for text in texts], repeat)
+    print("  original: {:.3f}s".format(original_time))
+    print("  current:  {:.3f}s".format(current_time))
+    print("  speed-up: {:.1f}x".format(original_time / current_time if current_time else float('inf')))
+
+    return len(different)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    failures = compare('awkward texts', AWKWARD_TEXTS, args.repeat)
+    failures += compare('stopwords', stopword_lines(), args.repeat)
+    for filename in args.csv_files:
+        texts = [document['text'].decode('utf8') for document in load_documents(filename)]
+        failures += compare(filename, texts, args.repeat)
+
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Time each stage of the pipeline on synthetic GOV.UK-like documents, and
+compare the results with a baseline.
+
+Documents are generated offline from a fixed seed, so every run sees the
+same text. For each corpus size, the stages are timed one after the other,
+and their wall time, CPU time, throughput and peak memory (RSS) are written
+to a JSON results file. Run it from anywhere:
+
+    python benchmarks/run.py --sizes 1000 10000 --output results.json
+
+To record a baseline, and later compare a change against it:
+
+    python benchmarks/run.py --output benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+
+Stages that are more than --tolerance slower, or use that much more memory,
+than in the baseline are reported, and the script exits with an error.
+"""
+from __future__ import print_function
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The stopwords and bigrams are read from paths relative to the repository
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+from corpus_building import CorpusReader, preprocess_unicode
+from gensim_engine import GensimEngine, Experiment
+from instrumentation import peak_rss, reset_peak_rss
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--sizes', dest='sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of documents to benchmark')
+parser.add_argument('--phrase-sample', dest='phrase_sample', type=int, default=200, help='Number of documents to time each phrase extraction mode on')
+parser.add_argument('--numtopics', dest='number_of_topics', type=int, default=20, help='Number of topics to train')
+parser.add_argument('--passes', dest='passes', type=int, default=5, help='Number of LDA passes')
+parser.add_argument('--seed', dest='seed', type=int, default=0, help='Seed for generating the documents')
+parser.add_argument('--output', dest='output', default=None, help='File to write the results to')
+parser.add_argument('--baseline', dest='baseline', default=None, help='Results file to compare with')
+parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.1, help='Fraction a stage may be slower or larger than the baseline')
+
+# Words that appear throughout GOV.UK's education content
+TOPIC_WORDS = '''
+school pupil teacher academy funding grant childcare nursery parent child
+curriculum assessment exam qualification apprenticeship college university
+student loan ofsted inspection governor headteacher trust council authority
+special needs disability admission attendance exclusion safeguarding report
+guidance policy statutory consultation department education skill training
+provider premium allowance budget allocation capital maintenance building
+local national primary secondary early year free meal transport holiday
+'''.split()
+
+FILLER_WORDS = 'the of and to a in for is on that by this with are be as from at or an will can must'.split()
+
+
+def bigram_words():
+    """
+    The words of the known bigrams, so that the bigram filter finds some.
+    """
+    with open(os.path.join(ROOT, 'input', 'bigrams.csv')) as f:
+        return [
+            tuple(part.split('/')[0] for part in row[0].split('_', 1))
+            for row in csv.reader(f)
+            if '_' in row[0]
+        ]
+
+
+def synthetic_documents(number_of_documents, seed=0):
+    """
+    Generate documents with a GOV.UK-like mix of topic words, known bigrams,
+    URLs, email addresses, phone numbers, amounts and non-ASCII punctuation.
+    """
+    random_state = random.Random(seed)
+    bigrams = bigram_words()
+    documents = []
+
+    for document_number in range(number_of_documents):
+        focus = random_state.sample(TOPIC_WORDS, 8)
+        sentences = []
+        for _ in range(random_state.randint(5, 40)):
+            words = []
+            for _ in range(random_state.randint(6, 18)):
+                choice = random_state.random()
+                if choice < 0.35:
+                    words.append(random_state.choice(FILLER_WORDS))
+                elif choice < 0.75:
+                    words.append(random_state.choice(focus))
+                elif choice < 0.9:
+                    words.extend(random_state.choice(bigrams))
+                else:
+                    words.append(random_state.choice(TOPIC_WORDS))
+
+            extra = random_state.random()
+            if extra < 0.05:
+                words.append('https://www.gov.uk/guidance/{}-{}'.format(*random_state.sample(TOPIC_WORDS, 2)))
+            elif extra < 0.08:
+                words.append('enquiries@{}.gov.uk'.format(random_state.choice(TOPIC_WORDS)))
+            elif extra < 0.11:
+                words.append('0370 000 {:04d}'.format(random_state.randint(0, 9999)))
+            elif extra < 0.15:
+                words.append(u'£{},000'.format(random_state.randint(1, 999)))
+            elif extra < 0.18:
+                words.append(u'‘café’ – résumé')
+
+            sentences.append(u' '.join(words).capitalize() + u'.')
+
+        documents.append({
+            'base_path': '/government/publications/{}-{}-{}'.format(focus[0], focus[1], document_number),
+            'text': u' '.join(sentences).encode('utf8'),
+        })
+
+    return documents
+
+
+def time_stage(results, name, items, function):
+    """
+    Run one stage, record its measurements under `name`, and return its
+    result.
+    """
+    reset = reset_peak_rss()
+    started_wall = time.time()
+    started_cpu = time.clock()
+
+    value = function()
+
+    wall_seconds = time.time() - started_wall
+    cpu_seconds = time.clock() - started_cpu
+    results[name] = dict(
+        wall_seconds=round(wall_seconds, 4),
+        cpu_seconds=round(cpu_seconds, 4),
+        items=items,
+        items_per_second=round(items / wall_seconds, 2) if wall_seconds > 0 else None,
+        peak_rss_bytes=peak_rss(),
+        peak_rss_reset=reset,
+    )
+    print("  {:<32} {:>9.3f}s {:>12} items/s {:>8.1f}MB".format(
+        name, wall_seconds, results[name]['items_per_second'], results[name]['peak_rss_bytes'] / 1024.0 / 1024.0))
+    return value
+
+
+def phrase_modes():
+    return [
+        ('lemmatisation', dict(use_lemmatisation=True)),
+        ('phrasemachine', dict(use_lemmatisation=False, use_phrasemachine=True)),
+        ('textacy', dict(use_lemmatisation=False, use_textacy=True)),
+    ]
+
+
+def benchmark_size(number_of_documents, args, working_directory):
+    results = {}
+    print("{} documents".format(number_of_documents))
+    documents = synthetic_documents(number_of_documents, seed=args.seed)
+    texts = [document['text'].decode('utf8') for document in documents]
+
+    time_stage(results, 'preprocess_unicode', len(texts), lambda: [preprocess_unicode(text) for text in texts])
+
+    sample = [preprocess_unicode(text) for text in texts[:args.phrase_sample]]
+    for mode, options in phrase_modes():
+        reader = CorpusReader(**options)
+        try:
+            time_stage(results, 'document_phrases.' + mode, len(sample), lambda: [reader.document_phrases(text) for text in sample])
+        except Exception as e:
+            # Some modes need models that may not be installed on this machine
+            print("  {:<32} skipped: {}".format('document_phrases.' + mode, e))
+            results['document_phrases.' + mode] = dict(skipped=str(e))
+
+    # Lemmatisation is the phrase mode train_lda.py uses by default
+    reader = CorpusReader(use_lemmatisation=True, no_below=2, no_above=0.5)
+    corpus, dictionary = time_stage(results, 'build_corpus', number_of_documents, lambda: reader.build_corpus(documents))
+    if len(dictionary) == 0:
+        sys.exit("No terms were kept in the dictionary of {} documents, so there's nothing to train on".format(number_of_documents))
+
+    engine = GensimEngine(corpus, dictionary, [dict(base_path=document['base_path']) for document in documents], corpus_reader=reader)
+    experiment = time_stage(results, 'train', number_of_documents * args.passes, lambda: engine.train(number_of_topics=args.number_of_topics, passes=args.passes))
+
+    name = 'benchmark-{}'.format(number_of_documents)
+    os.makedirs(os.path.join(working_directory, name, 'models'))
+    time_stage(results, 'save', number_of_documents, lambda: experiment.save(name, path=working_directory))
+    time_stage(results, 'save.binary', number_of_documents, lambda: experiment.save(name, path=working_directory, binary=True))
+    experiment = time_stage(results, 'load.lazy', number_of_documents, lambda: Experiment.load(name, path=working_directory, lazy=True))
+
+    time_stage(results, 'tag', number_of_documents, lambda: experiment.tag())
+    vis_filename = os.path.join(working_directory, name, 'vis.html')
+    time_stage(results, 'visualise', number_of_documents, lambda: experiment.visualise(vis_filename))
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print how each stage compares with the baseline, and return the stages
+    that got worse by more than `tolerance`.
+    """
+    regressions = []
+    for size, stages in sorted(results['sizes'].items(), key=lambda item: int(item[0])):
+        baseline_stages = baseline.get('sizes', {}).get(size)
+        if baseline_stages is None:
+            print("{} documents: not in the baseline".format(size))
+            continue
+
+        print("{} documents, compared with the baseline:".format(size))
+        for stage, measurements in sorted(stages.items()):
+            before = baseline_stages.get(stage)
+            if before is None or 'skipped' in before or 'skipped' in measurements:
+                continue
+
+            time_ratio = measurements['wall_seconds'] / before['wall_seconds'] if before['wall_seconds'] else 1.0
+            memory_ratio = float(measurements['peak_rss_bytes']) / before['peak_rss_bytes'] if before['peak_rss_bytes'] else 1.0
+            flag = ''
+            if time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance:
+                flag = '  <-- regression'
+                regressions.append((size, stage))
+
+            print("  {:<32} time x{:.2f}  memory x{:.2f}{}".format(stage, time_ratio, memory_ratio, flag))
+
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    results = dict(
+        created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        commit=git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        parameters=dict(number_of_topics=args.number_of_topics, passes=args.passes, phrase_sample=args.phrase_sample, seed=args.seed),
+        sizes={},
+    )
+
+    working_directory = tempfile.mkdtemp(prefix='lda-benchmark-')
+    try:
+        for size in args.sizes:
+            results['sizes'][str(size)] = benchmark_size(size, args, working_directory)
+    finally:
+        shutil.rmtree(working_directory)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        print("Results written to {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        if baseline.get('parameters') != results['parameters']:
+            print("Warning: the baseline was run with different parameters: {}".format(baseline.get('parameters')))
+
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
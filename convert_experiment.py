@@ -0,0 +1,55 @@
+"""
+Convert saved experiments to the compact binary format.
+
+The model files are kept as they are. The corpus, dictionary and metadata
+are rewritten, and the experiment is marked as binary so that
+Experiment.load picks the new files up. Their text versions are then
+removed.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import os
+from gensim_engine import Experiment
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    'experiments', metavar='EXPERIMENT', nargs='*',
+    help='Names of experiments to convert, eg 2016-11-01_15-44-06_695357'
+)
+parser.add_argument(
+    '--all', dest='all', action='store_true',
+    help='Convert every experiment in the experiments directory'
+)
+
+
+def saved_experiments(path=Experiment.DEFAULT_EXPERIMENT_PATH):
+    """
+    Names of the experiments under `path` that have a saved model.
+    """
+    model_filenames = glob.glob(os.path.join(path, '*', 'models', 'model'))
+    return sorted(os.path.basename(os.path.dirname(os.path.dirname(filename))) for filename in model_filenames)
+
+
+def convert(experiment_name):
+    if Experiment.binary_format_version(experiment_name) is not None:
+        print("{} is already in the binary format".format(experiment_name))
+        return
+
+    print("Converting {}".format(experiment_name))
+    experiment = Experiment.load(experiment_name, lazy=True)
+    experiment.save(experiment_name, binary=True)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    experiment_names = args.experiments
+    if args.all:
+        experiment_names = saved_experiments()
+
+    if not experiment_names:
+        parser.error('Pass the names of the experiments to convert, or --all')
+
+    for experiment_name in experiment_names:
+        convert(experiment_name)
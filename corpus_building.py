@@ -1,73 +1,264 @@
 import glob
 import argparse
 import csv
+import hashlib
+import json
 import logging
+import multiprocessing
 import re
 import sys
 import warnings
 import os
-from itertools import chain, repeat
+from itertools import islice
 from operator import itemgetter
 from gensim import corpora, models
 from gensim.utils import lemmatize
 from gensim.parsing.preprocessing import STOPWORDS
-from gensim.models import Phrases
-from nltk.corpus import stopwords
 from collections import Counter
-import pyLDAvis
-import pyLDAvis.gensim
-import phrasemachine
-import textacy
-from textacy import preprocess
+from backends import import_backend
+from csr_corpus import CsrCorpus
+from instrumentation import NO_METRICS, ProgressReporter
+from model_io import SpooledMetadata
+from token_cache import TokenCache
 
 import gensim
 
 PUNCTUATION_REGEX = re.compile(r'\W|[_0-9]', flags=re.UNICODE)
 
+class TransliterationTable(dict):
+    """
+    Maps code points to their ASCII transliteration, for `unicode.translate`.
+    Each character is transliterated by textacy the first time it's seen,
+    instead of character by character in Python for every document.
+    """
+    def __missing__(self, code_point):
+        if code_point < 128:
+            value = code_point
+        else:
+            preprocess = import_backend('textacy.preprocess')
+            value = unicode(preprocess.transliterate_unicode(unichr(code_point)))
+
+        self[code_point] = value
+        return value
+
+
+TRANSLITERATION = TransliterationTable()
+
+# Whether textacy transliterates to a byte string, which it does where
+# unidecode does. The type changes how the replacements below and
+# `remove_punct` treat the text. Set the first time text is transliterated.
+_TRANSLITERATES_TO_BYTES = None
+
+
+def transliterate(raw_text):
+    """
+    The same as textacy's transliterate_unicode, which transliterates each
+    character on its own.
+    """
+    global _TRANSLITERATES_TO_BYTES
+    if _TRANSLITERATES_TO_BYTES is None:
+        preprocess = import_backend('textacy.preprocess')
+        _TRANSLITERATES_TO_BYTES = isinstance(preprocess.transliterate_unicode(u''), str)
+
+    raw_text = raw_text.translate(TRANSLITERATION)
+    if _TRANSLITERATES_TO_BYTES:
+        return raw_text.encode('ascii')
+    return raw_text
+
+
 def preprocess_unicode(raw_text):
-    raw_text = preprocess.transliterate_unicode(raw_text.lower())
+    preprocess = import_backend('textacy.preprocess')
+    raw_text = transliterate(raw_text.lower())
     raw_text = preprocess.replace_urls(raw_text, replace_with=u'')
-    raw_text = preprocess.replace_emails(raw_text, replace_with=u'')
+    # Matching email addresses is the slowest replacement, and can't match
+    # without an @
+    if '@' in raw_text:
+        raw_text = preprocess.replace_emails(raw_text, replace_with=u'')
     raw_text = preprocess.replace_phone_numbers(raw_text, replace_with=u'')
     raw_text = preprocess.replace_numbers(raw_text, replace_with=u'')
     raw_text = preprocess.replace_currency_symbols(raw_text, replace_with=u'')
     return raw_text
 
-def load_stopwords():
-    stopwords = []
-    for filename in glob.glob('stopwords/*.txt'):
+BIGRAMS_FILE = 'input/bigrams.csv'
+STOPWORDS_FILES = 'stopwords/*.txt'
+STOPWORDS_CACHE = 'stopwords/.normalised.json'
+
+# Increase this when preprocess_unicode changes, so that the cached stopwords
+# are normalised again
+STOPWORDS_CACHE_VERSION = 1
+
+
+def _file_sha1(filename):
+    with open(filename, 'rb') as fileobj:
+        return hashlib.sha1(fileobj.read()).hexdigest()
+
+
+def _stopword_file_key(filename, cached=None):
+    """
+    Identify the contents of a stopword file by their hash. The file is only
+    hashed again if its size or modification time has changed since `cached`.
+    """
+    stat = os.stat(filename)
+    if cached and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+        return cached
+
+    return dict(mtime=stat.st_mtime, size=stat.st_size, sha1=_file_sha1(filename))
+
+
+def _cached_stopword_files(cache_filename):
+    """
+    Return the contents of the stopwords cache, and the keys of the files it
+    was built from, or empty dicts if there's no valid cache.
+    """
+    try:
+        with open(cache_filename) as cachefile:
+            cache = json.load(cachefile)
+    except (IOError, ValueError):
+        return {}, {}
+
+    if cache.get('version') != STOPWORDS_CACHE_VERSION:
+        return cache, {}
+    return cache, cache['files']
+
+
+def stopword_hashes(cache_filename=STOPWORDS_CACHE):
+    """
+    Return the hash of each stopword file, by filename, without normalising
+    the stopwords.
+    """
+    _, cached_files = _cached_stopword_files(cache_filename)
+    return dict(
+        (filename, _stopword_file_key(filename, cached_files.get(filename))['sha1'])
+        for filename in sorted(glob.glob(STOPWORDS_FILES))
+    )
+
+
+def normalise_stopwords(filenames):
+    preprocess = import_backend('textacy.preprocess')
+    stopwords = set()
+    for filename in filenames:
         with open(filename) as fileobj:
             for line in fileobj:
                 line = preprocess_unicode(line.decode('utf8').strip())
                 line = preprocess.remove_punct(line)
                 if line:
-                    stopwords.append(line)
+                    stopwords.add(line)
+
+    return stopwords
+
+
+def load_stopwords(cache_filename=STOPWORDS_CACHE):
+    """
+    Return the words in the stopword files, normalised in the same way as
+    documents, along with gensim's stopwords.
+
+    Normalising the stopword files is slow, so the result is cached in
+    `cache_filename`, and only normalised again if their contents change.
+    """
+    filenames = sorted(glob.glob(STOPWORDS_FILES))
+    cache, cached_files = _cached_stopword_files(cache_filename)
 
-    return stopwords + [word.decode('utf8') for word in STOPWORDS]
+    files = dict((filename, _stopword_file_key(filename, cached_files.get(filename))) for filename in filenames)
+    hashes = dict((filename, key['sha1']) for filename, key in files.items())
+    cached_hashes = dict((filename, key['sha1']) for filename, key in cached_files.items())
+
+    if cached_files and hashes == cached_hashes:
+        stopwords = cache['stopwords']
+    else:
+        stopwords = sorted(normalise_stopwords(filenames))
+
+    # Also rewrite the cache if only the modification times changed, so the
+    # files aren't hashed again next time
+    if files != cached_files:
+        temporary_filename = cache_filename + '.tmp'
+        try:
+            with open(temporary_filename, 'w') as cachefile:
+                json.dump(dict(version=STOPWORDS_CACHE_VERSION, files=files, stopwords=stopwords), cachefile)
+            os.rename(temporary_filename, cache_filename)
+        except (IOError, OSError):
+            # eg a read-only checkout
+            pass
+
+    return frozenset(stopwords) | frozenset(word.decode('utf8') for word in STOPWORDS)
+
+
+_STOPWORDS_UNICODE = None
+_STOPWORDS_BYTES = None
+
+
+def stopwords_unicode():
+    """
+    The stopwords as unicode strings, loaded the first time they're needed.
+    """
+    global _STOPWORDS_UNICODE
+    if _STOPWORDS_UNICODE is None:
+        _STOPWORDS_UNICODE = load_stopwords()
+    return _STOPWORDS_UNICODE
+
+
+def stopwords_bytes():
+    """
+    The stopwords as utf8 encoded strings, to compare with lemmas.
+    """
+    global _STOPWORDS_BYTES
+    if _STOPWORDS_BYTES is None:
+        _STOPWORDS_BYTES = frozenset(word.encode('utf8') for word in stopwords_unicode())
+    return _STOPWORDS_BYTES
 
 
-STOPWORDS_UNICODE = load_stopwords()
-STOPWORDS_BYTES = [word.encode('utf8') for word in STOPWORDS_UNICODE]
+# Reader used by each process of a preprocessing pool. It's set once per
+# worker by `_init_worker`, so that the bigram table is only loaded once.
+_WORKER_READER = None
+
+
+def _init_worker(reader):
+    global _WORKER_READER
+    _WORKER_READER = reader
+
+
+def _worker_text_phrases(text):
+    return _WORKER_READER.text_phrases(text)
 
 
 class CorpusReader(object):
     """
     Extract terms and phrases from raw text to run LDA on.
     """
-    def __init__(self, include_bigrams=True, use_phrasemachine=False, use_textacy=False, use_lemmatisation=False, use_tfidf=False, no_below=20, no_above=0.15, keep_n=None):
+    # Number of documents sent to a worker process at a time
+    WORKER_CHUNKSIZE = 20
+
+    # Number of documents tokenised at a time without worker processes
+    SERIAL_BATCH_SIZE = 100
+
+    def __init__(self, include_bigrams=True, use_phrasemachine=False, use_textacy=False, use_lemmatisation=False, use_tfidf=False, no_below=20, no_above=0.15, keep_n=None, workers=None, token_cache=None, token_cache_size=1024 * 1024 * 1024, lazy_tfidf=False, metrics=NO_METRICS):
         self.include_bigrams = include_bigrams
 
         self.use_phrasemachine = use_phrasemachine
         self.use_textacy = use_textacy
         self.use_lemmatisation = use_lemmatisation
         self.use_tfidf = use_tfidf
+        self.lazy_tfidf = lazy_tfidf
+        self.tfidf_model = None     # TF-IDF weights of the last corpus built, if used
         self.no_below = no_below
         self.no_above = no_above
         self.keep_n = keep_n
+        self.workers = workers
+        self.metrics = metrics      # Records the time and memory of each stage
 
-        with open('input/bigrams.csv', 'r') as f:
+        with open(BIGRAMS_FILE, 'r') as f:
             reader = csv.reader(f)
-            self.top_bigrams = [bigram[0] for bigram in list(reader)]
+            self.top_bigrams = frozenset(bigram[0] for bigram in reader)
+
+        self.token_cache = None
+        if token_cache:
+            # Cached phrases also depend on the bigrams and stopwords, so
+            # they're not reused once either file is edited
+            cache_options = dict(
+                self.tokenisation_options(),
+                bigrams_sha1=_file_sha1(BIGRAMS_FILE),
+                stopwords_sha1=stopword_hashes(),
+            )
+            self.token_cache = TokenCache(token_cache, cache_options, max_size=token_cache_size)
 
     def document_phrases(self, raw_text):
         """
@@ -86,30 +277,138 @@ class CorpusReader(object):
 
         return phrases
 
+    def text_phrases(self, text):
+        """
+        Extract phrases from the utf8 encoded text of a single document.
+        """
+        raw_text = preprocess_unicode(text.decode('utf8'))
+        return self.document_phrases(raw_text)
+
+    def iter_phrases(self, documents):
+        """
+        Yield each document along with its phrases, in the same order as the
+        input.
+
+        Documents are processed a batch at a time. If the reader has a token
+        cache, only documents that aren't in the cache are tokenised. If it has
+        more than one worker, they are tokenised by a pool of worker processes.
+        """
+        pool = None
+        batch_size = self.SERIAL_BATCH_SIZE
+        if self.workers and self.workers > 1:
+            # Load the stopwords before forking, so workers share them
+            # instead of each loading them
+            stopwords_unicode()
+            pool = multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self,))
+            batch_size = self.workers * self.WORKER_CHUNKSIZE * 4
+
+        documents = iter(documents)
+        progress = ProgressReporter("Processed documents")
+
+        try:
+            while True:
+                batch = list(islice(documents, batch_size))
+                if not batch:
+                    break
+
+                for document, phrases in zip(batch, self._batch_phrases(batch, pool)):
+                    progress.update(item=document['base_path'])
+                    yield document, phrases
+
+            progress.finish()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def _batch_phrases(self, batch, pool=None):
+        """
+        Extract the phrases of a batch of documents, reusing cached phrases
+        where possible.
+        """
+        texts = [document['text'] for document in batch]
+
+        if self.token_cache is not None:
+            phrases = self.token_cache.lookup(texts)
+        else:
+            phrases = [None] * len(texts)
+
+        missing = [index for index, document_phrases in enumerate(phrases) if document_phrases is None]
+        missing_texts = [texts[index] for index in missing]
+
+        if pool is not None:
+            computed = pool.map(_worker_text_phrases, missing_texts, chunksize=self.WORKER_CHUNKSIZE)
+        else:
+            computed = [self.text_phrases(text) for text in missing_texts]
+
+        for index, document_phrases in zip(missing, computed):
+            phrases[index] = document_phrases
+
+        if self.token_cache is not None and missing_texts:
+            self.token_cache.store(missing_texts, computed)
+
+        return phrases
+
+    def options(self):
+        """
+        The arguments needed to build another reader that processes documents
+        in the same way, so that new documents can be tagged consistently.
+        """
+        return dict(
+            self.tokenisation_options(),
+            use_tfidf=self.use_tfidf,
+            no_below=self.no_below,
+            no_above=self.no_above,
+            keep_n=self.keep_n,
+        )
+
+    def tokenisation_options(self):
+        """
+        The options that affect the phrases extracted from a document.
+        """
+        return dict(
+            include_bigrams=self.include_bigrams,
+            use_phrasemachine=self.use_phrasemachine,
+            use_textacy=self.use_textacy,
+            use_lemmatisation=self.use_lemmatisation,
+        )
+
+    def __getstate__(self):
+        # The token cache is only used by the main process, and its database
+        # connection can't be sent to worker processes. Neither can stages
+        # measured in a worker be added to the main process's metrics.
+        state = self.__dict__.copy()
+        state['token_cache'] = None
+        state['metrics'] = NO_METRICS
+        return state
+
     def fetch_document_bigrams(self, document_lemmas, number_of_bigrams=100):
         """
         Given a number of lemmas identifying a document, it calculates N bigrams
-        found in that document, where N=number_of_bigrams.
+        found in that document, where N=number_of_bigrams, and returns those
+        that are known bigrams, repeated once per occurrence.
         """
         if not self.include_bigrams:
             return []
 
-        bigram = Phrases()
-        bigram.add_vocab([document_lemmas])
         bigram_counter = Counter()
+        stopwords = stopwords_bytes()
+
+        # Count the same keys gensim's Phrases would: every pair of adjacent
+        # lemmas, and any single lemma that already contains the delimiter.
+        for lemma in document_lemmas:
+            if '_' in lemma and lemma not in stopwords:
+                bigram_counter[lemma] += 1
 
-        for key in bigram.vocab.keys():
-            if key not in STOPWORDS_BYTES:
-                if len(key.split("_")) > 1:
-                    bigram_counter[key] += bigram.vocab[key]
+        for first, second in zip(document_lemmas, document_lemmas[1:]):
+            key = first + '_' + second
+            if key not in stopwords:
+                bigram_counter[key] += 1
 
-        bigram_iterators = [
-            repeat(bigram, bigram_count)
-            for bigram, bigram_count
-            in bigram_counter.most_common(number_of_bigrams)
-        ]
-        found_bigrams = list(chain(*bigram_iterators))
-        known_bigrams = [bigram for bigram in found_bigrams if bigram in self.top_bigrams]
+        known_bigrams = []
+        for bigram, bigram_count in bigram_counter.most_common(number_of_bigrams):
+            if bigram in self.top_bigrams:
+                known_bigrams += [bigram] * bigram_count
 
         return known_bigrams
 
@@ -119,41 +418,112 @@ class CorpusReader(object):
 
         You can load an existing dictionary file to avoid computing it
         from scratch when retraining the model on the same input.
+
+        A TF-IDF corpus is weighted once and kept as a CsrCorpus, unless the
+        reader was created with `lazy_tfidf`, in which case the weights are
+        computed each time the corpus is read.
         """
         print("Generating lemmas for each of the documents")
-        phrases = []
-        for index, document in enumerate(documents):
-            print("[{}] processing {}".format(str(index), document['base_path']))
-            raw_text = preprocess_unicode(document['text'].decode('utf8'))
+        with self.metrics.stage('tokenise') as stage:
+            phrases = [document_phrases for _, document_phrases in self.iter_phrases(documents)]
+            stage.documents = len(phrases)
 
-            phrases.append(self.document_phrases(raw_text))
+        with self.metrics.stage('dictionary', documents=len(phrases)):
+            if dictionary_path:
+                print("Load pre-existing dictionary from file")
+                dictionary = corpora.Dictionary.load_from_text(dictionary_path)
+            else:
+                print("Turn our tokenized documents into a id <-> term dictionary")
+                dictionary = corpora.Dictionary(phrases)
 
-        if dictionary_path:
-            print("Load pre-existing dictionary from file")
-            dictionary = corpora.Dictionary.load_from_text(dictionary_path)
-        else:
-            print("Turn our tokenized documents into a id <-> term dictionary")
-            dictionary = corpora.Dictionary(phrases)
-
-            # Filter out very (in)frequent words. This changes the id <-> term mapping.
-            dictionary.filter_extremes(no_below=self.no_below, no_above=self.no_above, keep_n=self.keep_n)
+                # Filter out very (in)frequent words. This changes the id <-> term mapping.
+                dictionary.filter_extremes(no_below=self.no_below, no_above=self.no_above, keep_n=self.keep_n)
 
         print("Convert tokenized documents into a document-term matrix")
-        corpus = [dictionary.doc2bow(phrase) for phrase in phrases]
+        with self.metrics.stage('doc2bow', documents=len(phrases)):
+            corpus = [dictionary.doc2bow(phrase) for phrase in phrases]
 
         if self.use_tfidf:
             print("Generate TF-IDF corpus")
-            tfidfmodel = gensim.models.TfidfModel(corpus)
-            corpus = tfidfmodel[corpus]
+            with self.metrics.stage('tfidf', documents=len(corpus)):
+                self.tfidf_model = gensim.models.TfidfModel(corpus)
+                corpus = self.tfidf_model[corpus]
 
+                # Weigh every document once, rather than on every pass over the corpus
+                if not self.lazy_tfidf:
+                    corpus = CsrCorpus.from_corpus(corpus)
 
         return corpus, dictionary
 
+    def stream_corpus(self, documents, corpus_filename, dictionary_path=None):
+        """
+        Build a corpus and dictionary from the input documents, writing the
+        corpus straight to a Matrix Market file instead of keeping it in memory.
+
+        `documents` can be any iterable, such as `model_io.iter_documents`, and
+        is only read once. The first pass extracts the phrases, adds them to the
+        dictionary and spools them to disk. The second pass reads them back and
+        writes the document-term matrix to `corpus_filename`.
+
+        Returns the corpus (streamed from `corpus_filename`), the dictionary,
+        and the metadata of each document, spooled to a temporary file.
+        """
+        phrases_filename = corpus_filename + '.phrases'
+        bow_filename = corpus_filename + '.bow' if self.use_tfidf else corpus_filename
+        document_metadata = SpooledMetadata()
+
+        if dictionary_path:
+            print("Load pre-existing dictionary from file")
+            dictionary = corpora.Dictionary.load_from_text(dictionary_path)
+        else:
+            dictionary = corpora.Dictionary()
+
+        try:
+            # The dictionary is built as the documents are tokenised, so
+            # the tokenise stage includes adding them to it
+            print("Generating lemmas for each of the documents")
+            with self.metrics.stage('tokenise') as stage:
+                with open(phrases_filename, 'w') as phrases_file:
+                    for document, phrases in self.iter_phrases(documents):
+                        document_metadata.append(dict(base_path=document['base_path']))
+                        if not dictionary_path:
+                            dictionary.add_documents([phrases])
+                        phrases_file.write(json.dumps(phrases) + '\n')
+                stage.documents = len(document_metadata)
+
+            with self.metrics.stage('dictionary', documents=len(document_metadata)):
+                if not dictionary_path:
+                    # Filter out very (in)frequent words. This changes the id <-> term mapping.
+                    dictionary.filter_extremes(no_below=self.no_below, no_above=self.no_above, keep_n=self.keep_n)
+
+            print("Write the document-term matrix to {}".format(bow_filename))
+            with self.metrics.stage('doc2bow', documents=len(document_metadata)):
+                with open(phrases_filename) as phrases_file:
+                    bows = (dictionary.doc2bow(json.loads(line)) for line in phrases_file)
+                    corpora.MmCorpus.serialize(bow_filename, bows)
+        finally:
+            if os.path.exists(phrases_filename):
+                os.remove(phrases_filename)
+
+        corpus = corpora.MmCorpus(bow_filename)
+
+        if self.use_tfidf:
+            print("Write the TF-IDF corpus to {}".format(corpus_filename))
+            with self.metrics.stage('tfidf', documents=len(document_metadata)):
+                self.tfidf_model = gensim.models.TfidfModel(corpus)
+                corpora.MmCorpus.serialize(corpus_filename, self.tfidf_model[corpus])
+                os.remove(bow_filename)
+                os.remove(bow_filename + '.index')
+                corpus = corpora.MmCorpus(corpus_filename)
+
+        return corpus, dictionary, document_metadata
+
     def _phrases_in_raw_text_via_textacy(self, raw_text):
         """
         Builds a list of phrases from raw text using textacy.
         """
-        all_lemmas = lemmatize(raw_text, stopwords=STOPWORDS_UNICODE)
+        textacy = import_backend('textacy')
+        all_lemmas = lemmatize(raw_text, stopwords=stopwords_unicode())
         curated_words = [word.split('/')[0] for word in all_lemmas]
         curated_text = ' '.join(curated_words)
 
@@ -166,7 +536,6 @@ class CorpusReader(object):
         all_phrases += textacy.extract.ngrams(doc, 5, filter_stops=True, filter_punct=True, filter_nums=True)
 
         phrases = [unicode(phrase) for phrase in all_phrases]
-        print(phrases)
 
         return phrases
 
@@ -174,6 +543,8 @@ class CorpusReader(object):
         """
         Builds a list of phrases from raw text using phrasemachine.
         """
+        phrasemachine = import_backend('phrasemachine')
+
         # This returns a Dictionary of counts
         phrase_counts = phrasemachine.get_phrases(raw_text)['counts']
 
@@ -196,8 +567,7 @@ class CorpusReader(object):
         """
         Builds a list of lemmas from raw text using lemmatization.
         """
-        all_lemmas = lemmatize(raw_text, allowed_tags=re.compile('(NN|JJ)'), stopwords=STOPWORDS_UNICODE)
-        document_bigrams = self.fetch_document_bigrams(all_lemmas)
-        known_bigrams = [bigram for bigram in document_bigrams if bigram in self.top_bigrams]
+        all_lemmas = lemmatize(raw_text, allowed_tags=re.compile('(NN|JJ)'), stopwords=stopwords_unicode())
+        known_bigrams = self.fetch_document_bigrams(all_lemmas)
 
         return (all_lemmas + known_bigrams)
@@ -0,0 +1,101 @@
+"""
+A compact binary corpus format, stored as NumPy arrays that can be
+memory-mapped.
+"""
+from array import array
+import os
+import numpy
+import scipy.sparse
+
+
+class CsrCorpus(object):
+    """
+    A corpus stored in compressed sparse row (CSR) form: the term ids and
+    weights of every document, one after the other, and the offset where
+    each document starts. Document `n` is made of the entries from
+    `offsets[n]` to `offsets[n + 1]`.
+
+    Like an indexed MmCorpus, it can be iterated over and documents can be
+    read by number.
+    """
+    def __init__(self, offsets, term_ids, weights, filename=None):
+        self.offsets = offsets      # Start of each document, plus the end of the last one
+        self.term_ids = term_ids    # Term id of each entry
+        self.weights = weights      # Count or weight of each entry
+        self.filename = filename    # Where the arrays were loaded from, if anywhere
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, document_number):
+        start = self.offsets[document_number]
+        end = self.offsets[document_number + 1]
+        return list(zip(self.term_ids[start:end].tolist(), self.weights[start:end].tolist()))
+
+    def __iter__(self):
+        for document_number in xrange(len(self)):
+            yield self[document_number]
+
+    def sparse_matrix(self, number_of_terms):
+        """
+        The corpus as a SciPy sparse matrix, with a row per document and a
+        column per term. The arrays are shared, not copied.
+
+        `number_of_terms` must be more than the largest term id, which can be
+        more than the size of the dictionary. The term ids are checked, since
+        ids outside the matrix corrupt memory when it's used.
+        """
+        matrix = scipy.sparse.csr_matrix((self.weights, self.term_ids, self.offsets), shape=(len(self), number_of_terms))
+        matrix.check_format(full_check=True)
+        return matrix
+
+    @staticmethod
+    def from_corpus(corpus):
+        """
+        Build a CsrCorpus from any corpus of bag of words documents, in a
+        single pass.
+        """
+        offsets = array('l', [0])
+        term_ids = array('i')
+        weights = array('f')
+
+        for document in corpus:
+            for term_id, weight in document:
+                term_ids.append(term_id)
+                weights.append(weight)
+            offsets.append(len(term_ids))
+
+        return CsrCorpus(
+            numpy.frombuffer(offsets, dtype=numpy.dtype('l')).astype(numpy.int64),
+            numpy.frombuffer(term_ids, dtype=numpy.int32),
+            numpy.frombuffer(weights, dtype=numpy.float32),
+        )
+
+    def save(self, filename):
+        """
+        Save the arrays next to each other, as `filename`.offsets.npy etc.
+        """
+        for suffix, values in self._arrays():
+            temporary_filename = '{}.{}.tmp.npy'.format(filename, suffix)
+            numpy.save(temporary_filename, values)
+            os.rename(temporary_filename, '{}.{}.npy'.format(filename, suffix))
+
+    @staticmethod
+    def load(filename, mmap=True):
+        """
+        Load a saved corpus. By default the arrays are memory-mapped rather
+        than read into memory.
+        """
+        mmap_mode = 'r' if mmap else None
+        arrays = [
+            numpy.load('{}.{}.npy'.format(filename, suffix), mmap_mode=mmap_mode)
+            for suffix in ('offsets', 'term_ids', 'weights')
+        ]
+        return CsrCorpus(*arrays, filename=filename)
+
+    @staticmethod
+    def exists(filename):
+        return os.path.exists('{}.offsets.npy'.format(filename))
+
+    def _arrays(self):
+        return [('offsets', self.offsets), ('term_ids', self.term_ids), ('weights', self.weights)]
@@ -0,0 +1,112 @@
+"""
+A local stand-in for the GOV.UK search API, for trying out the importers
+without hitting a real environment.
+
+Every base path exists, and the search API returns a made-up document for
+each `filter_link`. Run it, then point the importer at it:
+
+    python data_import/fake_search_api.py --port 8080 --rate-limit 20
+    python data_import/import_indexable_content.py --environment http://localhost:8080 --workers 8 input.csv
+"""
+from __future__ import print_function
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--port', dest='port', type=int, default=8080, help='Port to listen on')
+parser.add_argument('--latency', dest='latency', type=float, default=0.05, help='Seconds to wait before each response')
+parser.add_argument('--rate-limit', dest='rate_limit', type=int, default=None, help='Respond with 429 to requests beyond this many per second')
+
+
+def fake_document(link):
+    words = ' '.join(link.strip('/').split('/')).replace('-', ' ')
+    return {
+        'link': link,
+        'title': words.title(),
+        'description': 'Description of {}'.format(words),
+        'indexable_content': 'Indexable content about {}'.format(words),
+        'expanded_topics': [{'title': 'Schools'}],
+        'expanded_organisations': [{'title': 'Department for Education'}],
+    }
+
+
+class FakeSearchHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        if self._rate_limited():
+            return
+        self.send_response(200)
+        self.end_headers()
+
+    def do_GET(self):
+        if self._rate_limited():
+            return
+
+        url = urlparse(self.path)
+        if url.path != '/api/search.json':
+            self.send_error(404)
+            return
+
+        params = parse_qs(url.query)
+        links = params.get('filter_link', []) + params.get('filter_link[]', [])
+        body = json.dumps({'results': [fake_document(link) for link in links]})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _rate_limited(self):
+        time.sleep(self.server.latency)
+        if self.server.allow_request():
+            return False
+
+        self.send_response(429)
+        self.send_header('Retry-After', '1')
+        self.end_headers()
+        return True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSearchServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.05, rate_limit=None):
+        HTTPServer.__init__(self, address, FakeSearchHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.recent_requests = deque()
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Allow at most `rate_limit` requests in any one second window.
+        """
+        if self.rate_limit is None:
+            return True
+
+        with self.lock:
+            now = time.time()
+            while self.recent_requests and self.recent_requests[0] < now - 1:
+                self.recent_requests.popleft()
+
+            if len(self.recent_requests) >= self.rate_limit:
+                return False
+
+            self.recent_requests.append(now)
+            return True
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    server = FakeSearchServer(('localhost', args.port), latency=args.latency, rate_limit=args.rate_limit)
+    print("Serving a fake search API on http://localhost:{}".format(args.port))
+    server.serve_forever()
@@ -3,9 +3,13 @@ import csv
 import sys
 import ipdb
 import json
+import argparse
 import requests
 import pdf_utils
 import requests_cache
+from multiprocessing.pool import ThreadPool
+from pdf_extraction import PdfExtractor
+from progress_journal import ProgressJournal
 from urlparse import urlparse
 from BeautifulSoup import BeautifulSoup
 
@@ -55,11 +59,13 @@ def valid_pdf_attachment(pdf_attachment):
     return pdf_extension and not_mailto and not_invalid
 
 
-def fetch_text_from_pdf_attachments(url):
+def fetch_text_from_pdf_attachments(url, extractor=None):
     """
     Given a GOV.UK URL, this function fetches the page from the content store,
     parses the PDF attachments (if any), and extracts the text from those
     attachments. It then returns the full text of the PDF attachments.
+
+    If a PdfExtractor is given, it's used to extract the text.
     """
 
     content_store_url = url.replace(
@@ -79,7 +85,10 @@ def fetch_text_from_pdf_attachments(url):
 
     for pdf_attachment in pdf_attachments:
         if valid_pdf_attachment(pdf_attachment):
-            pdf_text = pdf_utils.pdf_link_to_text(pdf_attachment)
+            if extractor is not None:
+                pdf_text = extractor.text_for(pdf_attachment)
+            else:
+                pdf_text = pdf_utils.pdf_link_to_text(pdf_attachment)
             pdf_contents.append(pdf_text)
 
     all_pdf_content = str.join(" ", pdf_contents)
@@ -88,20 +97,59 @@ def fetch_text_from_pdf_attachments(url):
     return all_pdf_content
 
 
+def fetch_url(url, extractor):
+    """
+    Fetch the PDF text of a URL, returning the error instead of raising it so
+    that one failure doesn't stop the whole import.
+    """
+    try:
+        print("===> Processing URL " + url)
+        return url, fetch_text_from_pdf_attachments(url, extractor), None
+    except Exception as e:
+        return url, None, e
+
+
 if __name__ == "__main__":
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    results = []
+    parser = argparse.ArgumentParser(description='Fetch the text of the PDF attachments of GOV.UK pages')
+    parser.add_argument('input_file', help='CSV file with a GOV.UK URL in its first column')
+    parser.add_argument('output_file', help='CSV file to write the URLs and their PDF text to')
+    parser.add_argument('--workers', dest='workers', type=int, default=4, help='Number of processes extracting PDF text, and of pages fetched at once')
+    parser.add_argument('--max-pages', dest='max_pages', type=int, default=None, help='Only extract text from the first N pages of each PDF')
+    parser.add_argument('--time-limit', dest='time_limit', type=float, default=None, help='Stop extracting text from a PDF after this many seconds')
+    parser.add_argument('--cache-dir', dest='cache_dir', default='pdf_cache', help='Directory to cache extracted text in, by PDF content hash')
+    args = parser.parse_args()
+
     requests_cache.install_cache()
 
-    csvfile = open(output_file, 'wb')
+    # Progress is recorded next to the output file, so running the same
+    # command again resumes an interrupted import and retries failed URLs.
+    journal = ProgressJournal(args.output_file + '.journal')
+    csvfile = journal.open_output(args.output_file)
     content_writer = csv.writer(csvfile, delimiter=',')
 
-    urls = fetch_education_urls(input_file)
-    for idx, url in enumerate(urls):
-        try:
-            print("===> Processing URL #" + str(idx) + " - " + url)
-            data = fetch_text_from_pdf_attachments(url)
-            content_writer.writerow([url, data])
-        except:
-            content_writer.writerow([url, ''])
+    extractor = PdfExtractor(
+        workers=args.workers,
+        cache_dir=args.cache_dir,
+        max_pages=args.max_pages,
+        time_limit=args.time_limit,
+    )
+    urls = [url for url in fetch_education_urls(args.input_file) if not journal.is_complete(url)]
+
+    # Pages are fetched in threads, while their PDFs are parsed in the
+    # extractor's processes. Rows are still written in input order.
+    threads = ThreadPool(args.workers)
+    results = threads.imap(lambda url: fetch_url(url, extractor), urls)
+
+    for url, data, error in results:
+        if error is not None:
+            sys.stderr.write("Failed to fetch PDFs for {}: {}\n".format(url, error))
+            journal.record_failure(url, error)
+            continue
+
+        content_writer.writerow([url, data])
+        journal.record_success(url, csvfile)
+
+    threads.close()
+
+    if journal.failed:
+        print("{} URLs failed. Run the same command again to retry them.".format(len(journal.failed)))
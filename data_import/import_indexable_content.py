@@ -1,6 +1,9 @@
 """
 Fetches the indexable content of GOV.UK pages using the search API, and prints
-it as CSV to stdout.
+it as CSV to stdout, or writes it to an output file.
+
+When writing to a file, progress is recorded in a journal next to it, so that
+an interrupted import can be resumed by running the same command again.
 
 Indexable content is format-dependent: it's whatever publishing applications
 decide to pass to rummager when indexing the document.
@@ -10,9 +13,14 @@ import requests
 import argparse
 import csv
 import sys
+import threading
 import time
+from collections import OrderedDict, defaultdict
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 from requests.packages.urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
+from progress_journal import ProgressJournal
 
 HEADER = ['url', 'link', 'title', 'description', 'content', 'topics', 'organisations']
 
@@ -22,12 +30,107 @@ parser.add_argument('--environment', '-e', dest='root_url', default='https://www
 parser.add_argument('--skip', '-s', dest='skip', type=int, default=0, help='Number of input rows to skip. Can be used to resume a partially completed import')
 parser.add_argument('--skip-redirects', '-r', dest='skip_redirects', action='store_true', help="Don't test URLs on GOV.UK to resolve redirected links.")
 parser.add_argument('--wait-time', '-w', dest='wait_time', type=float, default=0.1, help='Time to wait between each link, to work around rate limiting.')
-args = parser.parse_args()
+parser.add_argument('--workers', dest='workers', type=int, default=1, help='Number of links to fetch concurrently.')
+parser.add_argument('--rate', dest='rate', type=float, default=10.0, help='Maximum number of requests per second, shared between all workers.')
+parser.add_argument('--batch-size', '-b', dest='batch_size', type=int, default=1, help='Number of links to look up in each search API request.')
+parser.add_argument('--output', '-o', dest='output_file', default=None, help='Write the CSV to this file instead of stdout, keeping a journal so the import can be resumed.')
+
+session = None
+
+
+class TokenBucket(object):
+    """
+    Rate limiter shared between threads. It allows `rate` requests per
+    second on average, in bursts of up to `capacity` requests.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request is allowed.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                if now >= self.updated:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    # Paused, see below
+                    wait = self.updated - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop every worker from making requests for a while, for example
+        when the server responds with 429 Too Many Requests.
+        """
+        with self.lock:
+            self.tokens = 0
+            self.updated = max(self.updated, time.time() + seconds)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Wait for the rate limiter before sending each request. Responses served
+    from the cache don't reach the adapter, so they aren't limited.
+    """
+    def __init__(self, rate_limiter, **kwargs):
+        self.rate_limiter = rate_limiter
+        super(RateLimitedAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.rate_limiter.acquire()
+        return super(RateLimitedAdapter, self).send(request, **kwargs)
+
+
+class RateLimitedRetry(Retry):
+    """
+    Retry 429 responses, pausing the shared rate limiter so that the other
+    workers back off too.
+    """
+    def __init__(self, *args, **kwargs):
+        self.rate_limiter = kwargs.pop('rate_limiter', None)
+        super(RateLimitedRetry, self).__init__(*args, **kwargs)
 
-session = CachedSession(cache_name='govuk_cache', backend='sqlite')
-retries = Retry(total=5, backoff_factor=args.wait_time, status_forcelist=[ 429 ])
-session.mount('http://', HTTPAdapter(max_retries=retries))
-session.mount('https://', HTTPAdapter(max_retries=retries))
+    def new(self, **kwargs):
+        retry = super(RateLimitedRetry, self).new(**kwargs)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and response.status == 429 and self.rate_limiter is not None:
+            retry_after = response.getheader('Retry-After')
+            if retry_after and retry_after.isdigit():
+                self.rate_limiter.pause(int(retry_after))
+            else:
+                self.rate_limiter.pause(1.0 / self.rate_limiter.rate)
+
+        return super(RateLimitedRetry, self).increment(method, url, response, error, _pool, _stacktrace)
+
+
+def configure_session(args):
+    """
+    Set up the cached HTTP session used for all requests, which retries
+    rate limited requests and keeps to the rate limit.
+    """
+    global session
+
+    rate_limiter = TokenBucket(args.rate)
+    retries = RateLimitedRetry(total=5, backoff_factor=args.wait_time, status_forcelist=[ 429 ], rate_limiter=rate_limiter)
+
+    session = CachedSession(cache_name='govuk_cache', backend='sqlite')
+    session.mount('http://', RateLimitedAdapter(rate_limiter, max_retries=retries))
+    session.mount('https://', RateLimitedAdapter(rate_limiter, max_retries=retries))
 
 
 def test_base_path(original_base_path, args):
@@ -77,6 +180,34 @@ def request_search_result(link, search_url):
     return results[0]
 
 
+def request_search_results(links, search_url):
+    """
+    Fetch several links from the search API in a single request.
+
+    Returns a dictionary of link to search result. Links that don't have
+    exactly one result in the response are fetched again one at a time.
+    """
+    links = list(OrderedDict.fromkeys(link for link in links if link is not None))
+    if not links:
+        return {}
+
+    response = session.get(search_url, params=search_params_for_links(links))
+    response.raise_for_status()
+
+    results_by_link = defaultdict(list)
+    for result in response.json()['results']:
+        results_by_link[result.get('link')].append(result)
+
+    search_results = {}
+    for link in links:
+        if len(results_by_link[link]) == 1:
+            search_results[link] = results_by_link[link][0]
+        else:
+            search_results[link] = request_search_result(link, search_url)
+
+    return search_results
+
+
 def search_params_for_link(link):
     """
     Parameters to pass to the search API
@@ -94,6 +225,19 @@ def search_params_for_link(link):
     }
 
 
+def search_params_for_links(links):
+    """
+    Parameters to pass to the search API to fetch several links at once.
+    The link of each result is included so they can be matched up again.
+    """
+    params = search_params_for_link(None)
+    del params['filter_link']
+    params['filter_link[]'] = links
+    params['count'] = len(links)
+    params['fields[]'] = params['fields[]'] + ['link']
+    return params
+
+
 def extract_base_path(input_row):
     """
     Extract the base path from a GOV.UK URL
@@ -137,32 +281,109 @@ def format_result(url, link, search_result):
     }
 
 
-def fetch_rows(links_input_file, args):
+def fetch_batch(rows, args):
     """
-    Iterate through the input rows and yield the output rows
+    Fetch the output rows for a batch of input rows, looking all of their
+    links up in a single search API request if there's more than one.
     """
-    root_url = args.root_url
-    skip = args.skip
+    links = []
+    for row in rows:
+        url, original_base_path = extract_base_path(row)
+        links.append((url, test_base_path(original_base_path, args)))
 
-    for i, row in enumerate(csv.DictReader(links_input_file)):
-        if i < skip:
-            continue
+    search_url = args.root_url + '/api/search.json'
+    if len(links) > 1:
+        search_results = request_search_results([link for _, link in links], search_url)
+    else:
+        search_results = dict((link, request_search_result(link=link, search_url=search_url)) for _, link in links)
 
-        if i % 100 == 0 and i > 0:
-            sys.stderr.write('Row {}\n'.format(i + 1))
+    return [format_result(url, link, search_results.get(link, {})) for url, link in links]
 
-        url, original_base_path = extract_base_path(row)
-        real_base_path = test_base_path(original_base_path, args)
-        search_url = root_url + '/api/search.json'
-        search_result = request_search_result(link=real_base_path, search_url=search_url)
 
-        yield format_result(url, real_base_path, search_result)
+def batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def fetch_rows(links_input_file, args, journal=None):
+    """
+    Iterate through the input rows and yield the output rows, in the same
+    order. With more than one worker, batches of rows are fetched
+    concurrently.
+
+    If there's a progress journal, rows it has already completed are
+    skipped, and rows that fail are recorded in it instead of stopping the
+    import.
+    """
+    rows = (
+        row for i, row in enumerate(csv.DictReader(links_input_file))
+        if i >= args.skip and (journal is None or not journal.is_complete(extract_base_path(row)[0]))
+    )
+    row_batches = batches(rows, args.batch_size)
+
+    def fetch(batch):
+        if journal is None:
+            return batch, fetch_batch(batch, args), None
+        try:
+            return batch, fetch_batch(batch, args), None
+        except Exception as e:
+            return batch, [], e
+
+    if args.workers > 1:
+        pool = ThreadPool(args.workers)
+        results = pool.imap(fetch, row_batches)
+    else:
+        pool = None
+        results = (fetch(batch) for batch in row_batches)
+
+    try:
+        i = args.skip
+        for batch, output_batch, error in results:
+            if error is not None:
+                for row in batch:
+                    url = row.get('url', '').strip()
+                    sys.stderr.write('Failed to import {}: {}\n'.format(url, error))
+                    journal.record_failure(url, error)
+                continue
+
+            for output_row in output_batch:
+                if i % 100 == 0 and i > 0:
+                    sys.stderr.write('Row {}\n'.format(i + 1))
+                i += 1
+
+                yield output_row
+    finally:
+        if pool is not None:
+            pool.terminate()
 
 
 if __name__ == '__main__':
-    output = csv.DictWriter(sys.stdout, fieldnames=HEADER)
-    output.writeheader()
+    args = parser.parse_args()
+    configure_session(args)
+
+    journal = None
+    if args.output_file:
+        journal = ProgressJournal(args.output_file + '.journal')
+        output_file = journal.open_output(args.output_file)
+    else:
+        output_file = sys.stdout
+
+    output = csv.DictWriter(output_file, fieldnames=HEADER)
+    if journal is None or journal.output_offset == 0:
+        output.writeheader()
+        if journal is not None:
+            journal.checkpoint(output_file)
 
-    for row in fetch_rows(links_input_file=args.input_file, args=args):
+    for row in fetch_rows(links_input_file=args.input_file, args=args, journal=journal):
         output.writerow(row)
-        sys.stdout.flush()
+        if journal is not None:
+            journal.record_success(row['url'], output_file)
+        else:
+            output_file.flush()
+
+    if journal is not None and journal.failed:
+        sys.stderr.write('{} links failed. Run the same command again to retry them.\n'.format(len(journal.failed)))
@@ -0,0 +1,157 @@
+"""
+Download PDF attachments and extract their text in parallel.
+"""
+import os
+import threading
+import multiprocessing
+import pdf_utils
+
+
+class PdfExtractionError(Exception):
+    pass
+
+
+def _extract_text(connection, pdf_path, max_pages, time_limit):
+    """
+    Send the text of a PDF, or the error that stopped it being extracted,
+    back to the process that started this one.
+    """
+    try:
+        text = pdf_utils.convert_pdf_to_text(pdf_path, max_pages=max_pages, time_limit=time_limit)
+        connection.send((text, None))
+    except Exception as e:
+        connection.send((None, "{}: {}".format(type(e).__name__, e)))
+    finally:
+        connection.close()
+
+
+class PdfExtractor(object):
+    """
+    Extract the text of PDF attachments in worker processes.
+
+    Each PDF is streamed to disk and hashed as it downloads. Extracted text
+    is cached in `cache_dir` by the hash of the PDF's contents, so an
+    attachment that's linked from several pages, or under several URLs, is
+    only parsed once, even across runs.
+
+    Every PDF is parsed in a process of its own, with at most `workers`
+    running at once, so one that takes too long can be killed without
+    affecting the others.
+
+    `text_for` can be called from several threads at once, so downloads
+    overlap with extraction.
+    """
+    def __init__(self, workers=4, cache_dir='pdf_cache', max_pages=None, time_limit=None):
+        self.cache_dir = cache_dir
+        self.max_pages = max_pages
+        self.time_limit = time_limit
+        self.workers = threading.BoundedSemaphore(workers)
+
+        self.lock = threading.Lock()
+        self.url_hashes = {}    # Content hash of each URL downloaded in this run
+        self.extractions = {}   # Set when the pending extraction of a content hash finishes
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def text_for(self, url):
+        """
+        Return the text of the PDF at `url`.
+        """
+        with self.lock:
+            content_hash = self.url_hashes.get(url)
+
+        if content_hash is not None:
+            text = self._cached_text(content_hash)
+            if text is not None:
+                return text
+
+        pdf_path, content_hash = pdf_utils.stream_pdf_file(url)
+        try:
+            with self.lock:
+                self.url_hashes[url] = content_hash
+
+            text = self._cached_text(content_hash)
+            if text is None:
+                text = self._extract(content_hash, pdf_path)
+        finally:
+            os.remove(pdf_path)
+
+        return text
+
+    def _extract(self, content_hash, pdf_path):
+        """
+        Extract the text of a PDF and cache it, raising PdfExtractionError if
+        it can't be extracted in time. The PDF's process has always finished,
+        or been killed, by the time this returns.
+        """
+        # If another thread is already extracting the same PDF, wait for it
+        # and read its text from the cache, rather than parsing the file twice.
+        with self.lock:
+            finished = self.extractions.get(content_hash)
+            if finished is None:
+                self.extractions[content_hash] = threading.Event()
+
+        if finished is not None:
+            finished.wait()
+            text = self._cached_text(content_hash)
+            if text is None:
+                raise PdfExtractionError("Couldn't extract text from PDF {}".format(content_hash))
+            return text
+
+        try:
+            with self.workers:
+                text = self._run_extraction(pdf_path)
+            self._cache_text(content_hash, text)
+            return text
+        finally:
+            with self.lock:
+                self.extractions.pop(content_hash).set()
+
+    def _run_extraction(self, pdf_path):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_extract_text,
+            args=(sender, pdf_path, self.max_pages, self.time_limit)
+        )
+        process.start()
+        sender.close()
+
+        # The timeout starts once the PDF's process is running. The time
+        # limit is checked between pages, so allow a single slow page to
+        # overrun it before killing the process.
+        timeout = self.time_limit * 2 if self.time_limit is not None else None
+        try:
+            if not receiver.poll(timeout):
+                raise PdfExtractionError("Gave up extracting text from {} after {} seconds".format(pdf_path, timeout))
+            try:
+                text, error = receiver.recv()
+            except EOFError:
+                raise PdfExtractionError("Process extracting text from {} exited with code {}".format(pdf_path, process.exitcode))
+        finally:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            receiver.close()
+
+        if error is not None:
+            raise PdfExtractionError("Couldn't extract text from {}: {}".format(pdf_path, error))
+        return text
+
+    def _cache_filename(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash + '.txt')
+
+    def _cached_text(self, content_hash):
+        filename = self._cache_filename(content_hash)
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _cache_text(self, content_hash, text):
+        filename = self._cache_filename(content_hash)
+        temporary_filename = '{}.{}.tmp'.format(filename, threading.current_thread().ident)
+        with open(temporary_filename, 'wb') as f:
+            f.write(text)
+        os.rename(temporary_filename, filename)
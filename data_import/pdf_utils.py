@@ -3,7 +3,9 @@ import os
 import sys
 import ipdb
 import uuid
+import time
 import urllib
+import hashlib
 import StringIO
 from time import sleep
 from pdfminer.pdfpage import PDFPage
@@ -28,19 +30,40 @@ def download_pdf_file(download_url):
     """
     Given a PDF URL, this function download the file to a local file.
     """
+    filename, _ = stream_pdf_file(download_url)
+    return filename
+
+
+def stream_pdf_file(download_url, chunk_size=64 * 1024):
+    """
+    Given a PDF URL, this function downloads the file to a local file a chunk
+    at a time, without holding it in memory. It returns the filename and the
+    SHA-1 hash of the file's contents.
+    """
     web_file = urllib.urlopen(download_url)
     filename = "/tmp/" + str(uuid.uuid4()) + ".pdf"
-    local_file = open(filename, 'w')
-    local_file.write(web_file.read())
+    content_hash = hashlib.sha1()
+
+    with open(filename, 'wb') as local_file:
+        while True:
+            chunk = web_file.read(chunk_size)
+            if not chunk:
+                break
+            content_hash.update(chunk)
+            local_file.write(chunk)
+
     web_file.close()
-    local_file.close()
-    return filename
+    return filename, content_hash.hexdigest()
 
 
-def convert_pdf_to_text(pdf_path):
+def convert_pdf_to_text(pdf_path, max_pages=None, time_limit=None):
     """
     Given a path to a local PDF file, this function extracts text from it.
+
+    Only the first `max_pages` pages are read, and extraction stops after
+    the page that takes it past `time_limit` seconds.
     """
+    started = time.time()
     process_id = os.getpid()
     resource_manager = PDFResourceManager()
     output = StringIO.StringIO()
@@ -53,13 +76,18 @@ def convert_pdf_to_text(pdf_path):
     )
     interpreter = PDFPageInterpreter(resource_manager, device)
     file_handler = file(pdf_path, 'rb')
-    pages = PDFPage.get_pages(file_handler)
+    pages = PDFPage.get_pages(file_handler, maxpages=max_pages or 0)
 
     for idx, page in enumerate(pages):
         print("Page " + str(idx + 1), end='\r')
         sys.stdout.flush()
         interpreter.process_page(page)
+
+        if time_limit is not None and time.time() - started > time_limit:
+            print("Stopped extracting {} after {} pages".format(pdf_path, idx + 1))
+            break
     print()
+    file_handler.close()
 
     data = output.getvalue()
     data = data.replace('\n', ' ')
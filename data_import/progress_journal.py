@@ -0,0 +1,115 @@
+"""
+A durable record of an import's progress, so that an interrupted import
+can carry on exactly where it stopped.
+"""
+import json
+import os
+
+
+class ProgressJournal(object):
+    """
+    Append-only journal of the URLs an import has processed.
+
+    Each line records a URL and whether it was imported successfully. For
+    successful URLs it also records the size of the output file once the
+    URL's row had been written. The output file is synced to disk before
+    its size is recorded, and every line is synced as soon as it's written,
+    so the journal never points past data that's on disk.
+
+    When an import restarts, URLs that succeeded are skipped, URLs that
+    failed are tried again, and anything written to the output file after
+    the last recorded row is cut off.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.completed = set()
+        self.failed = set()
+        self.output_offset = 0
+
+        valid_length = 0
+        if os.path.exists(filename):
+            with open(filename, 'rb') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The import stopped while writing this line
+                        break
+                    if not line.endswith('\n'):
+                        break
+                    self._apply(entry)
+                    valid_length += len(line)
+
+            with open(filename, 'r+b') as journal:
+                journal.truncate(valid_length)
+
+        self.journal = open(filename, 'ab')
+
+    def is_complete(self, url):
+        return url in self.completed
+
+    def open_output(self, filename):
+        """
+        Open the output file for appending, first cutting off anything that
+        was written after the last recorded row, such as a half-written row.
+        """
+        if os.path.exists(filename):
+            with open(filename, 'r+b') as output:
+                output.truncate(self.output_offset)
+
+        output = open(filename, 'ab')
+        output.seek(0, os.SEEK_END)
+        return output
+
+    def record_success(self, url, output):
+        """
+        Record that the row for `url` has been written to `output`, the file
+        returned by `open_output`.
+        """
+        self._append({'url': url, 'status': 'ok', 'offset': self._sync_output(output)})
+
+    def record_failure(self, url, error):
+        """
+        Record that `url` couldn't be imported, so it's retried next time.
+        """
+        self._append({'url': url, 'status': 'failed', 'error': str(error)})
+
+    def checkpoint(self, output):
+        """
+        Record the size of the output file without completing a URL, for
+        example after writing a header.
+        """
+        self._append({'status': 'checkpoint', 'offset': self._sync_output(output)})
+
+    def close(self):
+        self.journal.close()
+
+    def _sync_output(self, output):
+        """
+        Write everything buffered for the output file to disk, and return
+        its size.
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        return output.tell()
+
+    def _append(self, entry):
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self._apply(entry)
+
+    def _apply(self, entry):
+        # JSON decodes URLs as unicode, but the importers read them as utf8 bytes
+        url = entry.get('url')
+        if isinstance(url, unicode):
+            url = url.encode('utf8')
+
+        if entry['status'] == 'ok':
+            self.completed.add(url)
+            self.failed.discard(url)
+            self.output_offset = entry['offset']
+        elif entry['status'] == 'failed':
+            self.failed.add(url)
+        elif entry['status'] == 'checkpoint':
+            self.output_offset = entry['offset']
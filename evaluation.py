@@ -0,0 +1,261 @@
+"""
+Measure the quality of a trained model: the perplexity of held-out
+documents, and the coherence of its topics.
+"""
+from array import array
+import math
+import os
+import numpy
+import scipy.sparse
+
+# Added to probabilities before taking logs, as gensim's coherence measures do
+EPSILON = 1e-12
+
+
+def heldout_documents(number_of_documents, fraction, seed=0):
+    """
+    Pick a random `fraction` of the document numbers to hold out of
+    training. The same seed always picks the same documents.
+    """
+    random_state = numpy.random.RandomState(seed)
+    return numpy.flatnonzero(random_state.rand(number_of_documents) < fraction)
+
+
+class ConvergenceMonitor(object):
+    """
+    Track how much each training pass improves a model, and decide when it
+    has converged: once `patience` passes in a row have improved it by less
+    than `threshold`.
+    """
+    def __init__(self, threshold=None, patience=2):
+        self.threshold = threshold
+        self.patience = patience
+        self.passes = 0     # Number of passes recorded
+        self.stalled = 0    # Number of passes in a row below the threshold
+        self.history = []   # Measurements after each pass
+
+    def record_score(self, score):
+        """
+        Record the held-out per-word likelihood bound after a pass. Higher is
+        better, and improvement is the relative change since the last pass.
+        Returns True once the model has converged.
+        """
+        improvement = None
+        if self.history and self.history[-1].get('score') is not None:
+            previous = self.history[-1]['score']
+            improvement = (score - previous) / abs(previous)
+
+        return self._record(dict(score=float(score), improvement=improvement))
+
+    def record_drift(self, topics_before, topics_after):
+        """
+        Record how far the topics' word distributions moved during a pass,
+        as the mean total variation distance. Returns True once the model has
+        converged.
+        """
+        drift = float(0.5 * numpy.abs(topics_after - topics_before).sum(axis=1).mean())
+        return self._record(dict(drift=drift, improvement=drift))
+
+    def record_pass(self):
+        """
+        Record a pass without measuring it.
+        """
+        return self._record({})
+
+    def state(self):
+        return dict(passes=self.passes, stalled=self.stalled, history=self.history)
+
+    def restore(self, state):
+        self.passes = state['passes']
+        self.stalled = state['stalled']
+        self.history = state['history']
+
+    def _record(self, entry):
+        self.passes += 1
+        entry['pass'] = self.passes
+        self.history.append(entry)
+
+        improvement = entry.get('improvement')
+        if self.threshold is None or improvement is None:
+            return False
+
+        if improvement < self.threshold:
+            self.stalled += 1
+        else:
+            self.stalled = 0
+
+        return self.stalled >= self.patience
+
+
+class CooccurrenceCounts(object):
+    """
+    Which documents each term appears in, stored as a sparse binary matrix
+    with a row per document and a column per term.
+
+    The number of documents containing any pair of terms can be read from
+    the matrix without going back to the corpus. The matrix can be saved, so
+    that models trained on the same corpus are scored without rebuilding it.
+    """
+    def __init__(self, matrix):
+        self.matrix = matrix.tocsc()
+        self.number_of_documents = matrix.shape[0]
+
+    @staticmethod
+    def from_corpus(corpus, number_of_terms):
+        """
+        Build the matrix in a single pass over a corpus of bag of words
+        documents.
+
+        `number_of_terms` is one more than the largest term id, such as the
+        model's `num_terms`. A curated dictionary's ids can have gaps, so it
+        can be more than the size of the dictionary.
+        """
+        indptr = array('l', [0])
+        indices = array('i')
+        for document in corpus:
+            indices.extend(term_id for term_id, weight in document if weight > 0)
+            indptr.append(len(indices))
+
+        indices = numpy.frombuffer(indices, dtype=numpy.int32)
+        matrix = _checked_matrix(
+            scipy.sparse.csr_matrix,
+            indices,
+            numpy.frombuffer(indptr, dtype=numpy.dtype('l')),
+            (len(indptr) - 1, number_of_terms)
+        )
+        return CooccurrenceCounts(matrix)
+
+    @staticmethod
+    def load_or_build(filename, corpus, number_of_terms):
+        """
+        Load the counts saved in `filename`, or build them from the corpus and
+        save them there. Saved counts with the wrong shape are rebuilt.
+        """
+        if os.path.exists(filename):
+            counts = CooccurrenceCounts.load(filename)
+            if counts.matrix.shape == (len(corpus), number_of_terms):
+                return counts
+
+        counts = CooccurrenceCounts.from_corpus(corpus, number_of_terms)
+        counts.save(filename)
+        return counts
+
+    def save(self, filename):
+        # Every entry is 1, so only the positions are stored
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'wb') as countsfile:
+            numpy.savez(countsfile, indices=self.matrix.indices, indptr=self.matrix.indptr, shape=numpy.array(self.matrix.shape))
+        os.rename(temporary_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        arrays = numpy.load(filename)
+        matrix = _checked_matrix(scipy.sparse.csc_matrix, arrays['indices'], arrays['indptr'], tuple(arrays['shape']))
+        return CooccurrenceCounts(matrix)
+
+    def pair_counts(self, term_ids):
+        """
+        Return a square array with the number of documents containing both of
+        each pair of terms. The diagonal holds each term's document count.
+        """
+        columns = self.matrix[:, list(term_ids)]
+        return (columns.T * columns).toarray()
+
+
+def _checked_matrix(matrix_class, indices, indptr, shape):
+    """
+    Build a sparse binary matrix from its index arrays. scipy doesn't check
+    the indices by default, and indices outside the matrix corrupt memory
+    when it's converted, so they're checked here.
+    """
+    matrix = matrix_class((numpy.ones(len(indices), dtype=numpy.int32), indices, indptr), shape=shape)
+    matrix.check_format(full_check=True)
+    return matrix
+
+
+def u_mass(counts, term_ids):
+    """
+    UMass coherence of a topic's top terms, most likely first: the mean over
+    pairs of log((D(w_i, w_j) + e) / D(w_j)) for j < i, with document counts
+    D as probabilities, like gensim's 'u_mass'.
+    """
+    probabilities = counts.pair_counts(term_ids) / float(counts.number_of_documents)
+
+    scores = []
+    for i in range(1, len(term_ids)):
+        for j in range(i):
+            scores.append(math.log((probabilities[i, j] + EPSILON) / max(probabilities[j, j], EPSILON)))
+
+    return float(numpy.mean(scores)) if scores else 0.0
+
+
+def c_v(counts, term_ids):
+    """
+    C_V coherence of a topic's top terms: the mean cosine similarity between
+    each term's normalised PMI vector and that of the whole set of terms.
+
+    gensim's 'c_v' counts co-occurrences in a sliding window over the text.
+    The corpus only keeps bags of words, so here a whole document is the
+    window.
+    """
+    probabilities = counts.pair_counts(term_ids) / float(counts.number_of_documents)
+    marginals = numpy.maximum(numpy.diag(probabilities), EPSILON)
+    joint = probabilities + EPSILON
+
+    denominator = -numpy.log(joint)
+    npmi = numpy.log(joint / numpy.outer(marginals, marginals)) / numpy.where(denominator > 0, denominator, 1.0)
+    # Terms that appear in every document are perfectly associated
+    npmi[denominator <= 0] = 1.0
+
+    topic_vector = npmi.sum(axis=0)
+    similarities = []
+    for term_vector in npmi:
+        norm = numpy.linalg.norm(term_vector) * numpy.linalg.norm(topic_vector)
+        similarities.append(term_vector.dot(topic_vector) / norm if norm > 0 else 0.0)
+
+    return float(numpy.mean(similarities))
+
+
+def heldout_perplexity(model, corpus, heldout):
+    """
+    Return the per-word likelihood bound of the held-out documents, and the
+    perplexity it implies. The corpus is read in a single pass, so it doesn't
+    need to support indexing.
+    """
+    heldout = set(int(document_number) for document_number in heldout)
+    chunk = [document for document_number, document in enumerate(corpus) if document_number in heldout]
+    if not chunk:
+        return None, None
+
+    per_word_bound = model.log_perplexity(chunk)
+    return per_word_bound, 2 ** -per_word_bound
+
+
+def evaluate(model, corpus, counts, heldout=None, top_words=10):
+    """
+    Score a model on its corpus. Returns a dict of the overall scores, and
+    the coherence of each topic.
+    """
+    topics = []
+    for topic_id in range(model.num_topics):
+        term_ids = [term_id for term_id, _ in model.get_topic_terms(topic_id, topn=top_words)]
+        topics.append({
+            'topic_id': topic_id,
+            'u_mass': u_mass(counts, term_ids),
+            'c_v': c_v(counts, term_ids),
+        })
+
+    per_word_bound, perplexity = None, None
+    if heldout is not None and len(heldout):
+        per_word_bound, perplexity = heldout_perplexity(model, corpus, heldout)
+
+    return {
+        'number_of_topics': model.num_topics,
+        'top_words': top_words,
+        'heldout_documents': 0 if heldout is None else len(heldout),
+        'per_word_bound': per_word_bound,
+        'perplexity': perplexity,
+        'u_mass': float(numpy.mean([topic['u_mass'] for topic in topics])),
+        'c_v': float(numpy.mean([topic['c_v'] for topic in topics])),
+        'topics': topics,
+    }
@@ -1,5 +1,8 @@
 import argparse
+import cPickle
 import csv
+import glob
+import hashlib
 import logging
 import re
 import json
@@ -9,29 +12,32 @@ import os
 from itertools import chain, repeat
 from operator import itemgetter
 from gensim import corpora, models
-from gensim.utils import lemmatize
-from gensim.parsing.preprocessing import STOPWORDS
-from gensim.models import Phrases
-from nltk.corpus import stopwords
 from collections import Counter
+from backends import import_backend
 from corpus_building import CorpusReader
-import pyLDAvis
-import pyLDAvis.gensim
+from csr_corpus import CsrCorpus
+from evaluation import ConvergenceMonitor, CooccurrenceCounts, evaluate, heldout_documents
+from model_io import iter_documents
 
 import gensim
+import numpy
 warnings.filterwarnings('error')
 
 csv.field_size_limit(sys.maxsize)
 
 
 class GensimEngine(object):
-    def __init__(self, corpus, dictionary, document_metadata, log=False, corpus_reader=None):
+    def __init__(self, corpus, dictionary, document_metadata, log=False, corpus_reader=None, reader_options=None, tfidf_model=None):
         """
         The corpus is a bag of words (a list of lists of tuples)
         The dictionary maps word ids to strings
+        The reader options are the CorpusReader arguments used to build the corpus
+        The TF-IDF model weighs the corpus, if it was built with TF-IDF
         """
         self.topics = []
         self.ldamodel = None
+        self.heldout = None
+        self.training_report = None
         self.corpus = corpus
         self.dictionary = dictionary
         self.document_metadata = document_metadata
@@ -39,6 +45,14 @@ class GensimEngine(object):
         # TODO: this shouldn't be needed
         self.corpus_reader = corpus_reader
 
+        self.reader_options = reader_options
+        if reader_options is None and corpus_reader is not None:
+            self.reader_options = corpus_reader.options()
+
+        self.tfidf_model = tfidf_model
+        if tfidf_model is None and corpus_reader is not None:
+            self.tfidf_model = corpus_reader.tfidf_model
+
         if log:
             logging.basicConfig(
                 format='%(asctime)s : %(levelname)s : %(message)s',
@@ -56,24 +70,344 @@ class GensimEngine(object):
         return GensimEngine(corpus, dictionary, log=log, corpus_reader=reader, document_metadata=document_metadata)
 
     @staticmethod
-    def from_experiment(name, log=False):
-        experiment = Experiment.load(name)
-        return GensimEngine(experiment.corpus, experiment.dictionary, experiment.document_metadata, log=log)
+    def from_csv(filename, corpus_filename, log=False, dictionary_path=None, **reader_kwargs):
+        """
+        Stream documents from a CSV file, writing the corpus to
+        `corpus_filename` as it goes. Memory use depends on the size of the
+        vocabulary rather than the number of documents.
+        """
+        reader = CorpusReader(**reader_kwargs)
+        corpus, dictionary, document_metadata = reader.stream_corpus(
+            iter_documents(filename),
+            corpus_filename,
+            dictionary_path=dictionary_path
+        )
+        return GensimEngine(corpus, dictionary, log=log, corpus_reader=reader, document_metadata=document_metadata)
+
+    @staticmethod
+    def from_experiment(name, log=False, lazy=False, trainable=False):
+        """
+        Load a saved experiment, including its model, so that it can be
+        retrained from scratch or updated with new documents.
+        """
+        experiment = Experiment.load(name, lazy=lazy, trainable=trainable)
+        engine = GensimEngine(experiment.corpus, experiment.dictionary, experiment.document_metadata, log=log, reader_options=experiment.reader_options, tfidf_model=experiment.tfidf_model)
+        engine.ldamodel = experiment.ldamodel
+        engine.heldout = experiment.heldout
+        return engine
 
-    def train(self, number_of_topics=20, words_per_topic=8, passes=50):
+    def train(self, number_of_topics=20, words_per_topic=8, passes=50, workers=None, chunksize=2000, update_every=1, holdout=0.0, convergence_threshold=None, patience=2, checkpoint_filename=None, checkpoint_every=1):
         """
         It trains the LDA algorithm against the documents set in the
         initializer. We can control the number of topics we need and how many
         iterations the algorithm should make.
+
+        If `workers` is set, the E-step of each chunk is spread across that
+        many worker processes using gensim's multicore LDA. `chunksize` is the
+        number of documents in each training chunk, and `update_every` is the
+        number of chunks to process before each M-step (0 means batch
+        training, updating the model once per pass).
+
+        If `holdout` is set, that fraction of the documents is left out of
+        training, so that the model's perplexity can be measured on them.
+        They're still tagged.
+
+        If `convergence_threshold` is set, training stops early once
+        `patience` passes in a row have improved the model by less than the
+        threshold. With held-out documents, improvement is the relative
+        change in their per-word likelihood bound. Without them, it's how far
+        the topics' word distributions moved.
+
+        If `checkpoint_filename` is set, the model is saved there every
+        `checkpoint_every` passes. Training the same corpus with the same
+        settings again carries on from the last checkpoint.
         """
-        print("Generate LDA model")
-        self.ldamodel = gensim.models.ldamodel.LdaModel(
-            self.corpus,
-            num_topics=number_of_topics,
-            id2word=self.dictionary,
-            passes=passes
+        training_corpus = self.corpus
+        self.heldout = None
+        if holdout:
+            self.heldout = heldout_documents(len(self.corpus), holdout)
+            training_corpus = CorpusSubset(self.corpus, excluded=self.heldout)
+            print("Holding out {} documents".format(len(self.heldout)))
+
+        if convergence_threshold is None and checkpoint_filename is None:
+            self.ldamodel = self._new_model(training_corpus, number_of_topics, passes, workers, chunksize, update_every)
+            self.training_report = dict(passes_used=passes, max_passes=passes, converged=None, history=[])
+        else:
+            self._train_in_passes(training_corpus, number_of_topics, passes, workers, chunksize, update_every, convergence_threshold, patience, checkpoint_filename, checkpoint_every)
+
+        return self._experiment(number_of_topics, words_per_topic)
+
+    def _new_model(self, corpus, number_of_topics, passes, workers, chunksize, update_every):
+        """
+        Create a model, and train it if `corpus` is given.
+        """
+        if workers:
+            print("Generate LDA model using {} workers".format(workers))
+            return gensim.models.ldamulticore.LdaMulticore(
+                corpus,
+                num_topics=number_of_topics,
+                id2word=self.dictionary,
+                passes=passes,
+                workers=workers,
+                chunksize=chunksize,
+                batch=(update_every == 0)
+            )
+        else:
+            print("Generate LDA model")
+            return gensim.models.ldamodel.LdaModel(
+                corpus,
+                num_topics=number_of_topics,
+                id2word=self.dictionary,
+                passes=passes,
+                chunksize=chunksize,
+                update_every=update_every
+            )
+
+    def _train_in_passes(self, training_corpus, number_of_topics, passes, workers, chunksize, update_every, convergence_threshold, patience, checkpoint_filename, checkpoint_every):
+        """
+        Train one pass at a time, checking for convergence and saving
+        checkpoints in between.
+        """
+        heldout_chunk = None
+        if self.heldout is not None and len(self.heldout):
+            heldout = set(int(document_number) for document_number in self.heldout)
+            heldout_chunk = [bow for document_number, bow in enumerate(self.corpus) if document_number in heldout]
+
+        # A checkpoint is only resumed by a run training the same thing
+        checkpoint_key = dict(
+            number_of_topics=number_of_topics,
+            number_of_terms=len(self.dictionary),
+            number_of_documents=len(self.corpus),
+            heldout_documents=0 if self.heldout is None else len(self.heldout),
+            multicore=bool(workers),
+            chunksize=chunksize,
+            update_every=update_every,
         )
 
+        self.ldamodel = None
+        monitor = ConvergenceMonitor(convergence_threshold, patience)
+        if checkpoint_filename is not None:
+            self.ldamodel = self._load_checkpoint(checkpoint_filename, checkpoint_key, monitor, workers)
+
+        if self.ldamodel is None:
+            self.ldamodel = self._new_model(None, number_of_topics, 1, workers, chunksize, update_every)
+
+        converged = False
+        for pass_number in range(monitor.passes, passes):
+            measure_drift = convergence_threshold is not None and heldout_chunk is None
+            if measure_drift:
+                topics_before = self._topic_word_distributions()
+
+            self.ldamodel.update(training_corpus)
+
+            if convergence_threshold is None:
+                monitor.record_pass()
+            elif measure_drift:
+                converged = monitor.record_drift(topics_before, self._topic_word_distributions())
+            else:
+                converged = monitor.record_score(self.ldamodel.log_perplexity(heldout_chunk))
+
+            if checkpoint_filename is not None and (monitor.passes % checkpoint_every == 0 or converged):
+                self._save_checkpoint(checkpoint_filename, checkpoint_key, monitor)
+
+            if converged:
+                break
+
+        print("Trained for {} of at most {} passes".format(monitor.passes, passes))
+        self.training_report = dict(passes_used=monitor.passes, max_passes=passes, converged=converged if convergence_threshold is not None else None, history=monitor.history)
+
+        if checkpoint_filename is not None:
+            for filename in glob.glob(checkpoint_filename + '*'):
+                os.remove(filename)
+
+    def _topic_word_distributions(self):
+        topics = self.ldamodel.state.get_lambda()
+        return topics / topics.sum(axis=1)[:, numpy.newaxis]
+
+    def _save_checkpoint(self, checkpoint_filename, checkpoint_key, monitor):
+        # The progress file is removed while the model is saved, so a run
+        # killed half way through saving doesn't resume from a broken model
+        progress_filename = checkpoint_filename + '.json'
+        if os.path.exists(progress_filename):
+            os.remove(progress_filename)
+
+        self.ldamodel.save(checkpoint_filename)
+
+        with open(progress_filename, 'w') as progressfile:
+            json.dump(dict(key=checkpoint_key, monitor=monitor.state()), progressfile)
+
+    def _load_checkpoint(self, checkpoint_filename, checkpoint_key, monitor, workers):
+        progress_filename = checkpoint_filename + '.json'
+        if not os.path.exists(progress_filename):
+            return None
+
+        with open(progress_filename) as progressfile:
+            progress = json.load(progressfile)
+
+        if progress['key'] != checkpoint_key:
+            print("Ignoring a checkpoint of different training settings")
+            return None
+
+        monitor.restore(progress['monitor'])
+        print("Resuming from the checkpoint after pass {}".format(monitor.passes))
+
+        if workers:
+            return gensim.models.ldamulticore.LdaMulticore.load(checkpoint_filename)
+        return gensim.models.ldamodel.LdaModel.load(checkpoint_filename)
+
+    def update(self, documents, new_terms='freeze', max_new_terms=1000, min_new_term_count=2, passes=1, chunksize=2000, words_per_topic=8, **reader_kwargs):
+        """
+        Add new or changed documents to a trained experiment, and continue
+        training its model on them, instead of retraining from scratch.
+
+        Only the given documents are tokenised, using the experiment's reader
+        options. A document whose `base_path` is already in the corpus
+        replaces the old version; any other document is appended.
+
+        `new_terms` controls the dictionary. With 'freeze', terms that aren't
+        already in it are ignored. With 'extend', up to `max_new_terms` of them
+        are added, most common first, if they're in at least
+        `min_new_term_count` of the new documents. The model gets a row of
+        prior-only weights for each new term before it's updated.
+
+        In a TF-IDF experiment, the new documents are weighed with the saved
+        TF-IDF model, so they're weighed the same way as the existing corpus.
+        """
+        if self.ldamodel is None:
+            raise ValueError('There is no trained model to update')
+
+        if self.reader_options is None:
+            raise ValueError("The experiment's reader options aren't known, so new documents can't be tokenised consistently")
+
+        if self.reader_options.get('use_tfidf') and self.tfidf_model is None:
+            raise ValueError("The experiment was saved without its TF-IDF model, so new documents can't be weighed consistently")
+
+        if new_terms not in ('freeze', 'extend'):
+            raise ValueError('Unknown new terms policy: {}'.format(new_terms))
+
+        reader = CorpusReader(**dict(self.reader_options, **reader_kwargs))
+        base_paths = []
+        phrases = []
+        for document, document_phrases in reader.iter_phrases(documents):
+            base_paths.append(document['base_path'])
+            phrases.append(document_phrases)
+
+        document_numbers = dict((metadata['base_path'], number) for number, metadata in enumerate(self.document_metadata))
+        replaced = set(document_numbers[base_path] for base_path in base_paths if base_path in document_numbers)
+        self._update_document_frequencies(phrases, replaced)
+
+        if new_terms == 'extend':
+            added = self._extend_dictionary(phrases, max_new_terms, min_new_term_count)
+            print("Added {} new terms to the dictionary".format(added))
+
+        bows = [self.dictionary.doc2bow(document_phrases) for document_phrases in phrases]
+        if self.tfidf_model is not None:
+            bows = [self.tfidf_model[bow] for bow in bows]
+
+        replacements = {}
+        additions = []
+        for base_path, bow in zip(base_paths, bows):
+            if base_path in document_numbers:
+                replacements[document_numbers[base_path]] = bow
+            else:
+                document_numbers[base_path] = len(self.document_metadata)
+                self.document_metadata.append(dict(base_path=base_path))
+                additions.append(bow)
+
+        print("Replacing {} documents and adding {}".format(len(replacements), len(additions)))
+        self.corpus = UpdatedCorpus(self.corpus, replacements, additions)
+
+        print("Update LDA model")
+        self.ldamodel.update(bows, chunksize=chunksize, passes=passes)
+
+        return self._experiment(self.ldamodel.num_topics, words_per_topic)
+
+    def _update_document_frequencies(self, phrases, replaced_documents=()):
+        """
+        Count the new documents in the frequencies of terms already in the
+        dictionary, after removing the old versions of the documents they
+        replace.
+
+        The old versions are only known as bags of words, so terms that were
+        filtered out of the dictionary can't be removed from the position
+        counts, and in a TF-IDF corpus neither can repeated terms.
+        """
+        if replaced_documents:
+            for document_number, bow in enumerate(self.corpus):
+                if document_number not in replaced_documents:
+                    continue
+
+                self.dictionary.num_docs -= 1
+                self.dictionary.num_nnz -= len(bow)
+                if self.tfidf_model is None:
+                    self.dictionary.num_pos -= int(sum(weight for _, weight in bow))
+                for term_id, _ in bow:
+                    self.dictionary.dfs[term_id] = max(self.dictionary.dfs.get(term_id, 0) - 1, 0)
+
+        for document_phrases in phrases:
+            self.dictionary.num_docs += 1
+            self.dictionary.num_pos += len(document_phrases)
+            self.dictionary.num_nnz += len(set(document_phrases))
+            for term in set(document_phrases):
+                term_id = self.dictionary.token2id.get(term)
+                if term_id is not None:
+                    self.dictionary.dfs[term_id] = self.dictionary.dfs.get(term_id, 0) + 1
+
+    def _extend_dictionary(self, phrases, max_new_terms, min_new_term_count):
+        """
+        Add the most common unknown terms to the dictionary and the model.
+        Returns the number of terms added.
+        """
+        document_counts = Counter()
+        for document_phrases in phrases:
+            document_counts.update(term for term in set(document_phrases) if term not in self.dictionary.token2id)
+
+        new_terms = [
+            term for term, count in document_counts.most_common(max_new_terms)
+            if count >= min_new_term_count
+        ]
+        if not new_terms:
+            return 0
+
+        # A curated dictionary's ids can have gaps, so new ids start after
+        # the largest, where the model's new columns will be
+        for term_id, term in enumerate(new_terms, self.ldamodel.num_terms):
+            self.dictionary.token2id[term] = term_id
+            self.dictionary.dfs[term_id] = document_counts[term]
+
+            # Without an IDF, the TF-IDF model would drop the new term
+            if self.tfidf_model is not None:
+                self.tfidf_model.dfs[term_id] = document_counts[term]
+                self.tfidf_model.idfs[term_id] = self.tfidf_model.wglobal(document_counts[term], self.tfidf_model.num_docs)
+
+        # Rebuilt the next time a term is looked up by id
+        self.dictionary.id2token = {}
+
+        self._extend_model(len(new_terms))
+        return len(new_terms)
+
+    def _extend_model(self, number_of_terms):
+        """
+        Give the model columns for new terms. New terms start with no
+        sufficient statistics, so their weights in each topic come from the
+        prior alone until the model is updated.
+        """
+        model = self.ldamodel
+        state = model.state
+
+        state.sstats = numpy.hstack([state.sstats, numpy.zeros((model.num_topics, number_of_terms), dtype=state.sstats.dtype)])
+
+        # A learned prior differs per term, so new terms get its average
+        if numpy.ndim(model.eta) == 1:
+            model.eta = numpy.concatenate([model.eta, numpy.repeat(numpy.mean(model.eta), number_of_terms)])
+        if numpy.ndim(state.eta) == 1:
+            state.eta = numpy.concatenate([state.eta, numpy.repeat(numpy.mean(state.eta), number_of_terms)])
+
+        model.num_terms += number_of_terms
+        model.id2word = self.dictionary
+        model.sync_state()
+
+    def _experiment(self, number_of_topics, words_per_topic):
         raw_topics = self.ldamodel.show_topics(
             num_topics=number_of_topics,
             num_words=words_per_topic,
@@ -82,7 +416,59 @@ class GensimEngine(object):
 
         self.topics = [{'topic_id': topic_id, 'words': words} for topic_id, words in raw_topics]
 
-        return Experiment(model=self.ldamodel, corpus=self.corpus, dictionary=self.dictionary, document_metadata=self.document_metadata)
+        return Experiment(model=self.ldamodel, corpus=self.corpus, dictionary=self.dictionary, document_metadata=self.document_metadata, reader_options=self.reader_options, heldout=self.heldout, tfidf_model=self.tfidf_model)
+
+
+class CorpusSubset(object):
+    """
+    A corpus without some of its documents, such as those held out of
+    training.
+    """
+    def __init__(self, corpus, excluded):
+        self.corpus = corpus
+        self.excluded = frozenset(int(document_number) for document_number in excluded)
+
+    def __len__(self):
+        return len(self.corpus) - len(self.excluded)
+
+    def __iter__(self):
+        for document_number, bow in enumerate(self.corpus):
+            if document_number not in self.excluded:
+                yield bow
+
+
+class UpdatedCorpus(object):
+    """
+    A stored corpus with some of its documents replaced and new ones added
+    at the end, read without rewriting the stored corpus. It's written out
+    when the experiment is saved.
+    """
+    def __init__(self, corpus, replacements, additions):
+        self.corpus = corpus                # Original corpus
+        self.replacements = replacements    # Document number -> new bag of words
+        self.additions = additions          # Bags of words of documents to add
+
+    def __len__(self):
+        return len(self.corpus) + len(self.additions)
+
+    def __iter__(self):
+        for document_number, bow in enumerate(self.corpus):
+            yield self.replacements.get(document_number, bow)
+
+        for bow in self.additions:
+            yield bow
+
+
+class PreparedVisualisation(object):
+    """
+    pyLDAvis data that has already been turned into JSON, so that it can be
+    cached and drawn again.
+    """
+    def __init__(self, json_data):
+        self.json_data = json_data
+
+    def to_json(self):
+        return self.json_data
 
 
 class Experiment(object):
@@ -91,51 +477,375 @@ class Experiment(object):
     """
     DEFAULT_EXPERIMENT_PATH = os.path.join('experiments')
 
-    def __init__(self, model, corpus, dictionary, document_metadata):
+    # First line of the models/FORMAT file of experiments saved in the binary format
+    BINARY_FORMAT = 'govuk-lda-tagger binary experiment'
+    BINARY_FORMAT_VERSION = 1
+
+    def __init__(self, model, corpus, dictionary, document_metadata, reader_options=None, heldout=None, tfidf_model=None):
         self.ldamodel = model                       # Trained LDA model
         self.corpus = corpus                        # List of documents where each document is a bag of words
         self.dictionary = dictionary                # Id -> Text mapping for terms
         self.document_metadata = document_metadata  # List of document metadata
+        self.doc_topics = None                      # Topic distribution of each document, once inferred
+        self.reader_options = reader_options        # CorpusReader arguments used to build the corpus, if known
+        self.heldout = heldout                      # Numbers of the documents left out of training, if any
+        self.tfidf_model = tfidf_model              # TF-IDF model the corpus was weighed with, if any
+        self.mapped_model_filename = None           # File the model is memory-mapped from, if loaded lazily
+        self.models_path = None                     # Directory the experiment was loaded from or saved to
 
     @staticmethod
-    def load(experiment_name, path=DEFAULT_EXPERIMENT_PATH):
+    def load(experiment_name, path=DEFAULT_EXPERIMENT_PATH, lazy=False, trainable=False):
+        """
+        Load a saved experiment. The format it was saved in is detected
+        automatically.
+
+        If `lazy` is set, the corpus isn't read into memory: documents are
+        streamed from the corpus file, or read by document number using its
+        index. The model's arrays are memory-mapped read-only, so the model
+        can be used for inference but not trained further, unless
+        `trainable` is set. A text corpus is parsed again on every pass over
+        it, so don't load lazily to train for many passes.
+
+        The corpus of a binary experiment is always memory-mapped.
+        """
         model_filename = Experiment._filename(path, experiment_name, 'model')
         corpus_filename = Experiment._filename(path, experiment_name, 'corpus')
         dictionary_filename = Experiment._filename(path, experiment_name, 'dict')
         meta_filename = Experiment._filename(path, experiment_name, 'meta')
+        reader_filename = Experiment._filename(path, experiment_name, 'reader')
+        heldout_filename = Experiment._filename(path, experiment_name, 'heldout.npy')
+        tfidf_filename = Experiment._filename(path, experiment_name, 'tfidf')
+
+        map_model = lazy and not trainable
+        model = gensim.models.ldamodel.LdaModel.load(model_filename, mmap='r' if map_model else None)
+
+        if Experiment.binary_format_version(experiment_name, path) is not None:
+            corpus = CsrCorpus.load(corpus_filename)
+            dictionary = corpora.Dictionary.load(dictionary_filename + '.bin')
+            document_metadata = gensim.utils.unpickle(meta_filename + '.bin')
+        else:
+            if lazy:
+                corpus = corpora.MmCorpus(corpus_filename)
+            else:
+                corpus = list(corpora.MmCorpus(corpus_filename))
+
+            # Experiments saved before the binary dictionary was added only have the text version
+            if os.path.exists(dictionary_filename + '.bin'):
+                dictionary = corpora.Dictionary.load(dictionary_filename + '.bin')
+            else:
+                dictionary = corpora.Dictionary.load_from_text(dictionary_filename)
+
+            with open(meta_filename) as metafile:
+                document_metadata = json.load(metafile)
+
+        # Experiments saved before the reader options were recorded don't have this file
+        reader_options = None
+        if os.path.exists(reader_filename):
+            with open(reader_filename) as readerfile:
+                reader_options = json.load(readerfile)
+
+        heldout = None
+        if os.path.exists(heldout_filename):
+            heldout = numpy.load(heldout_filename)
+
+        # Experiments saved before the TF-IDF model was recorded don't have this file
+        tfidf_model = None
+        if os.path.exists(tfidf_filename):
+            tfidf_model = gensim.models.TfidfModel.load(tfidf_filename)
+
+        experiment = Experiment(model=model, corpus=corpus, dictionary=dictionary, document_metadata=document_metadata, reader_options=reader_options, heldout=heldout, tfidf_model=tfidf_model)
+        if map_model:
+            experiment.mapped_model_filename = model_filename
+        experiment.models_path = os.path.dirname(model_filename)
+
+        return experiment
+
+    @staticmethod
+    def binary_format_version(experiment_name, path=DEFAULT_EXPERIMENT_PATH):
+        """
+        Return the version of the binary format an experiment was saved in,
+        or None if it was saved as Matrix Market and text files.
+        """
+        format_filename = Experiment._filename(path, experiment_name, 'FORMAT')
+        if not os.path.exists(format_filename):
+            return None
 
-        model = gensim.models.ldamodel.LdaModel.load(model_filename)
-        corpus = list(corpora.MmCorpus(corpus_filename))
-        dictionary = corpora.Dictionary.load_from_text(dictionary_filename)
+        with open(format_filename) as formatfile:
+            name, _, version = formatfile.readline().strip().rpartition(' ')
 
-        with open(meta_filename) as metafile:
-            document_metadata = json.load(metafile)
+        if name != Experiment.BINARY_FORMAT or not version.isdigit() or int(version) > Experiment.BINARY_FORMAT_VERSION:
+            raise ValueError('Unsupported experiment format in {}'.format(format_filename))
 
-        return Experiment(model=model, corpus=corpus, dictionary=dictionary, document_metadata=document_metadata)
+        return int(version)
 
-    def save(self, experiment_name, path=DEFAULT_EXPERIMENT_PATH):
+    def save(self, experiment_name, path=DEFAULT_EXPERIMENT_PATH, binary=False):
+        """
+        Save the experiment. By default the corpus is saved in Matrix Market
+        format and the dictionary and metadata as text.
+
+        If `binary` is set, the corpus is saved as NumPy arrays, and the
+        dictionary and metadata are pickled. These load much faster. Any
+        text files they replace are removed.
+        """
         model_filename = self._filename(path, experiment_name, 'model')
         corpus_filename = self._filename(path, experiment_name, 'corpus')
         dictionary_filename = self._filename(path, experiment_name, 'dict')
         meta_filename = Experiment._filename(path, experiment_name, 'meta')
+        reader_filename = Experiment._filename(path, experiment_name, 'reader')
+        format_filename = Experiment._filename(path, experiment_name, 'FORMAT')
+        heldout_filename = Experiment._filename(path, experiment_name, 'heldout.npy')
+        cooccurrence_filename = Experiment._filename(path, experiment_name, 'cooccurrence.npz')
+        tfidf_filename = Experiment._filename(path, experiment_name, 'tfidf')
+
+        if not binary and os.path.exists(format_filename):
+            os.remove(format_filename)
+
+        if self.heldout is not None:
+            numpy.save(heldout_filename, self.heldout)
+        elif os.path.exists(heldout_filename):
+            os.remove(heldout_filename)
+
+        if self.reader_options is not None:
+            with open(reader_filename, 'wb') as readerfile:
+                json.dump(self.reader_options, readerfile)
+
+        if self.tfidf_model is not None:
+            self.tfidf_model.save(tfidf_filename)
+
+        # A memory-mapped model can't have changed, and overwriting the
+        # files it's mapped from would break it.
+        if self.mapped_model_filename != model_filename:
+            # Store the large arrays in their own files, so that they can be memory-mapped
+            self.ldamodel.save(model_filename, separately=['expElogbeta', 'sstats'])
+            self._remove_visualisation_cache(os.path.dirname(model_filename))
+
+        self.models_path = os.path.dirname(model_filename)
+
+        if binary:
+            self._save_binary_corpus(corpus_filename, cooccurrence_filename)
+            self.dictionary.save(dictionary_filename + '.bin')
+            self._save_metadata_pickle(meta_filename + '.bin')
+
+            # Written last, so that a partially saved experiment isn't mistaken for a binary one
+            with open(format_filename, 'w') as formatfile:
+                formatfile.write('{} {}\n'.format(Experiment.BINARY_FORMAT, Experiment.BINARY_FORMAT_VERSION))
+
+            # Once the experiment is marked as binary, the text versions of
+            # the corpus, dictionary and metadata are never read again
+            for filename in (corpus_filename, corpus_filename + '.index', dictionary_filename, meta_filename):
+                self._remove_stale_file(filename)
+        else:
+            self._save_metadata_json(meta_filename)
+
+            self._save_corpus(corpus_filename, cooccurrence_filename)
+            self.dictionary.save_as_text(dictionary_filename)
+            self.dictionary.save(dictionary_filename + '.bin')
+
+    def _save_binary_corpus(self, corpus_filename, cooccurrence_filename):
+        """
+        Save the corpus as NumPy arrays, unless it was loaded from them.
+        """
+        if isinstance(self.corpus, CsrCorpus) and self.corpus.filename is not None and os.path.abspath(self.corpus.filename) == os.path.abspath(corpus_filename):
+            return
+
+        corpus = self.corpus if isinstance(self.corpus, CsrCorpus) else CsrCorpus.from_corpus(self.corpus)
+        corpus.save(corpus_filename)
+        self._remove_stale_file(cooccurrence_filename)
+
+        if not self._corpus_in_memory():
+            self.corpus = CsrCorpus.load(corpus_filename)
+
+    def _save_corpus(self, corpus_filename, cooccurrence_filename):
+        """
+        Serialise the corpus, unless it's already stored in that file.
+
+        A streamed corpus may be reading from the file we're about to
+        overwrite, so it's written to a temporary file first and then
+        reopened from its new location. A corpus held in memory is kept, so
+        later stages don't parse the file again.
+        """
+        if isinstance(self.corpus, corpora.MmCorpus) and os.path.abspath(self.corpus.input) == os.path.abspath(corpus_filename):
+            return
+
+        temporary_filename = corpus_filename + '.tmp'
+        corpora.MmCorpus.serialize(temporary_filename, self.corpus)
+        os.rename(temporary_filename, corpus_filename)
+        os.rename(temporary_filename + '.index', corpus_filename + '.index')
+        self._remove_stale_file(cooccurrence_filename)
+
+        if not self._corpus_in_memory():
+            self.corpus = corpora.MmCorpus(corpus_filename)
 
+    def _corpus_in_memory(self):
+        """
+        Whether the corpus is held in memory, rather than read from a file.
+        """
+        return isinstance(self.corpus, list) or (isinstance(self.corpus, CsrCorpus) and self.corpus.filename is None)
+
+    def _save_metadata_json(self, meta_filename):
+        """
+        Save the document metadata as a JSON list, a document at a time, so
+        that metadata spooled to disk isn't read into memory.
+        """
         with open(meta_filename, 'wb') as metafile:
-            json.dump(self.document_metadata, metafile)
+            metafile.write('[')
+            for document_number, metadata in enumerate(self.document_metadata):
+                if document_number:
+                    metafile.write(', ')
+                json.dump(metadata, metafile)
+            metafile.write(']')
+
+    def _save_metadata_pickle(self, meta_filename):
+        """
+        Pickle the document metadata as a list. The pickler doesn't memoise,
+        so it doesn't keep a reference to every document it has written.
+        """
+        with open(meta_filename, 'wb') as metafile:
+            pickler = cPickle.Pickler(metafile, cPickle.HIGHEST_PROTOCOL)
+            pickler.fast = True
+            pickler.dump(self.document_metadata)
+
+    @staticmethod
+    def _remove_stale_file(filename):
+        """
+        Remove a file that's out of date or has been replaced, if it exists.
+        """
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def weigh(self, bows):
+        """
+        Weigh new bag of words documents the same way as the corpus: with the
+        experiment's TF-IDF model, if it has one.
+        """
+        if self.tfidf_model is None:
+            return bows
 
-        self.ldamodel.save(model_filename)
-        corpora.MmCorpus.serialize(corpus_filename, self.corpus)
-        self.dictionary.save_as_text(dictionary_filename)
+        return [self.tfidf_model[bow] for bow in bows]
 
-    def visualise(self, filename):
+    def evaluate(self, cooccurrence_filename=None, top_words=10):
+        """
+        Measure the model's perplexity on the held-out documents, if any,
+        and the u_mass and c_v coherence of its topics' `top_words` terms.
+
+        Coherence is computed from the document co-occurrence counts of the
+        corpus. If `cooccurrence_filename` is given, the counts are cached
+        there, so that other models of the same corpus are scored without
+        reading the corpus again.
+        """
+        # Term ids can have gaps, so the model's number of terms is the
+        # largest id plus one rather than the size of the dictionary
+        number_of_terms = self.ldamodel.num_terms
+        if cooccurrence_filename is not None:
+            counts = CooccurrenceCounts.load_or_build(cooccurrence_filename, self.corpus, number_of_terms)
+        else:
+            counts = CooccurrenceCounts.from_corpus(self.corpus, number_of_terms)
+
+        return evaluate(self.ldamodel, self.corpus, counts, heldout=self.heldout, top_words=top_words)
+
+    def visualise(self, filename, relevant_terms=30, lambda_step=0.01, mds='pcoa'):
         """
         Visualise the topics generated
         """
         # Create visualisation
-        viz = pyLDAvis.gensim.prepare(self.ldamodel, self.corpus, self.dictionary)
+        viz = self.visualisation_data(relevant_terms=relevant_terms, lambda_step=lambda_step, mds=mds)
 
         # Output HTML object
+        pyLDAvis = import_backend('pyLDAvis')
         pyLDAvis.save_html(data=viz, fileobj=filename)
 
+    def visualisation_data(self, relevant_terms=30, lambda_step=0.01, mds='pcoa'):
+        """
+        Prepare the data pyLDAvis needs to draw the topics.
+
+        Once the experiment has been saved, the prepared data is cached in
+        its models directory for each set of parameters, so the
+        visualisation can be drawn again without recomputing it. The cache is
+        cleared whenever the model is saved again.
+        """
+        parameters = dict(R=relevant_terms, lambda_step=lambda_step, mds=mds)
+
+        cache_filename = None
+        if self.models_path is not None:
+            key = hashlib.sha1(json.dumps(parameters, sort_keys=True)).hexdigest()[:12]
+            cache_filename = os.path.join(self.models_path, 'vis-{}.json'.format(key))
+            if os.path.exists(cache_filename):
+                with open(cache_filename) as cachefile:
+                    return PreparedVisualisation(cachefile.read())
+
+        inputs = self.visualisation_inputs()
+        vocab = [self.dictionary[term_id] for term_id in self._visualised_term_ids()]
+        pyLDAvis = import_backend('pyLDAvis')
+        prepared = PreparedVisualisation(pyLDAvis.prepare(vocab=vocab, **dict(inputs, **parameters)).to_json())
+
+        if cache_filename is not None:
+            temporary_filename = cache_filename + '.tmp'
+            with open(temporary_filename, 'w') as cachefile:
+                cachefile.write(prepared.to_json())
+            os.rename(temporary_filename, cache_filename)
+
+        return prepared
+
+    def visualisation_inputs(self):
+        """
+        The model's topic-term distributions, the topic distribution and
+        length of each document, and the frequency of each term, as arrays.
+
+        The document topics inferred for tagging are reused, and lengths
+        and frequencies are sums over the rows and columns of the corpus as a
+        sparse matrix. Once the experiment has been saved, the arrays are
+        cached in its models directory.
+        """
+        cache_filename = None
+        if self.models_path is not None:
+            cache_filename = os.path.join(self.models_path, 'vis_inputs.npz')
+            if os.path.exists(cache_filename):
+                arrays = numpy.load(cache_filename)
+                return dict((name, arrays[name]) for name in arrays.files)
+
+        # Only the columns of terms in the dictionary are shown, since a
+        # curated dictionary's ids can have gaps
+        term_ids = self._visualised_term_ids()
+
+        topic_term_dists = self.ldamodel.state.get_lambda()[:, term_ids]
+        topic_term_dists = topic_term_dists / topic_term_dists.sum(axis=1)[:, numpy.newaxis]
+
+        doc_topic_dists = self.doc_topics
+        if doc_topic_dists is None:
+            doc_topic_dists = self.document_topics()
+
+        corpus = self.corpus if isinstance(self.corpus, CsrCorpus) else CsrCorpus.from_corpus(self.corpus)
+        matrix = corpus.sparse_matrix(self.ldamodel.num_terms)
+        doc_lengths = numpy.asarray(matrix.sum(axis=1)).ravel()
+        term_frequency = numpy.asarray(matrix.sum(axis=0)).ravel()[term_ids]
+
+        # pyLDAvis divides by term frequencies, so its gensim helper sets
+        # those of unused terms to 0.01, and so does this
+        term_frequency[term_frequency == 0] = 0.01
+
+        inputs = dict(
+            topic_term_dists=topic_term_dists,
+            doc_topic_dists=doc_topic_dists,
+            doc_lengths=doc_lengths,
+            term_frequency=term_frequency,
+        )
+
+        if cache_filename is not None:
+            temporary_filename = cache_filename + '.tmp'
+            with open(temporary_filename, 'wb') as cachefile:
+                numpy.savez(cachefile, **inputs)
+            os.rename(temporary_filename, cache_filename)
+
+        return inputs
+
+    def _visualised_term_ids(self):
+        return numpy.array(sorted(self.dictionary.token2id.values()), dtype=numpy.int_)
+
+    @staticmethod
+    def _remove_visualisation_cache(models_path):
+        for filename in glob.glob(os.path.join(models_path, 'vis-*.json')) + [os.path.join(models_path, 'vis_inputs.npz')]:
+            Experiment._remove_stale_file(filename)
+
     def topics(self, number_of_topics=20, words_per_topic=8):
         raw_topics = self.ldamodel.show_topics(
             num_topics=number_of_topics,
@@ -144,19 +854,77 @@ class Experiment(object):
 
         return [{'topic_id': topic_id, 'words': words} for topic_id, words in raw_topics]
 
-    def tag(self, top_topics=3):
+    def tag(self, top_topics=3, chunksize=2000):
         """
         Given a list of documents (dictionary with `base_path` and `text`), this
         method adds an extra key to each of the dictionaries with the top 3
         topics associated with the document.
+
+        Topics are inferred for a chunk of documents at a time.
         """
+        doc_topics = self.document_topics(chunksize=chunksize)
+
         tagged_documents = []
-        for document_number, document in enumerate(self.document_metadata):
-            document['tags'] = self.topics_for(document_number, top_topics)
+        for document, tags in zip(self.document_metadata, self.top_topics(doc_topics, top_topics)):
+            document['tags'] = tags
             tagged_documents.append(document)
 
         return tagged_documents
 
+    def document_topics(self, chunksize=2000):
+        """
+        Infer the topic distribution of every document in the corpus. Returns
+        an array with one row per document and one column per topic.
+        """
+        self.doc_topics = self.infer_topics(self.corpus, chunksize=chunksize)
+        return self.doc_topics
+
+    def infer_topics(self, bows, chunksize=2000):
+        """
+        Infer the topic distributions of bag of words documents, running the
+        model on a chunk of documents at a time.
+        """
+        blocks = []
+        for chunk in gensim.utils.grouper(bows, chunksize):
+            gamma, _ = self.ldamodel.inference(chunk)
+            blocks.append(gamma / gamma.sum(axis=1)[:, numpy.newaxis])
+
+        if not blocks:
+            return numpy.zeros((0, self.ldamodel.num_topics))
+
+        return numpy.vstack(blocks)
+
+    @staticmethod
+    def top_topics(doc_topics, top_topics=3, minimum_probability=0.01):
+        """
+        Pick the most likely topics of each row of a document-topic array.
+
+        Returns a list of (topic_id, probability) tuples for each document,
+        most likely first, leaving out topics below `minimum_probability`.
+        """
+        number_of_topics = min(top_topics, doc_topics.shape[1])
+        rows = numpy.arange(doc_topics.shape[0])[:, numpy.newaxis]
+
+        # Partially sort each row to find its top topics, then sort only those
+        top = numpy.argpartition(-doc_topics, number_of_topics - 1, axis=1)[:, :number_of_topics]
+        order = numpy.argsort(-doc_topics[rows, top], axis=1)
+        top = top[rows, order]
+        probabilities = doc_topics[rows, top]
+
+        return [
+            [(int(topic_id), float(probability)) for topic_id, probability in zip(topic_ids, topic_probabilities) if probability >= minimum_probability]
+            for topic_ids, topic_probabilities in zip(top, probabilities)
+        ]
+
+    def save_document_topics(self, filename):
+        """
+        Save the topic distribution of every document as a NumPy array.
+        """
+        if self.doc_topics is None:
+            self.document_topics()
+
+        numpy.save(filename, self.doc_topics)
+
     def topics_for(self, document_number, top_topics=3):
         """
         Given a single document, it returns a list of topics for the document.
@@ -0,0 +1,223 @@
+"""
+Measure where a run spends its time and memory.
+"""
+from __future__ import print_function
+import json
+import resource
+import signal
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process, so the next reading only covers what
+    happens from now on. Returns False if the kernel doesn't allow it.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def peak_rss():
+    """
+    Peak RSS of this process in bytes, since it started or was last reset.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux, and can't be reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stage(object):
+    """
+    Measurements of a single stage of a run. Set `documents` during the
+    stage if the number of documents isn't known beforehand.
+    """
+    def __init__(self, name, documents=None):
+        self.name = name
+        self.documents = documents
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = 0
+
+    def as_dict(self):
+        documents_per_second = None
+        if self.documents is not None and self.wall_seconds:
+            documents_per_second = round(self.documents / self.wall_seconds, 2)
+
+        return dict(
+            name=self.name,
+            wall_seconds=round(self.wall_seconds, 4),
+            cpu_seconds=round(self.cpu_seconds, 4),
+            documents=self.documents,
+            documents_per_second=documents_per_second,
+            peak_rss_bytes=self.peak_rss_bytes,
+        )
+
+
+class PipelineMetrics(object):
+    """
+    Record the wall time, CPU time, throughput and peak memory of each stage
+    of a run:
+
+        with metrics.stage('tokenise') as stage:
+            ...
+            stage.documents = len(documents)
+
+    Stages can be nested. The peak memory of a stage includes the stages
+    inside it. CPU time only covers this process, not worker processes.
+    """
+    def __init__(self):
+        self.stages = []
+        self.active = []
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name, documents=None):
+        stage = Stage(name, documents)
+
+        # Resetting the peak loses the enclosing stages' peak so far, so
+        # fold it into them first
+        self._fold_peak(peak_rss())
+        reset_peak_rss()
+        self.active.append(stage)
+
+        started_wall = time.time()
+        started_cpu = time.clock()
+        try:
+            yield stage
+        finally:
+            stage.wall_seconds = time.time() - started_wall
+            stage.cpu_seconds = time.clock() - started_cpu
+
+            self.active.pop()
+            stage.peak_rss_bytes = max(stage.peak_rss_bytes, peak_rss())
+            self._fold_peak(stage.peak_rss_bytes)
+            self.stages.append(stage)
+
+    def _fold_peak(self, value):
+        for stage in self.active:
+            stage.peak_rss_bytes = max(stage.peak_rss_bytes, value)
+
+    def as_dict(self):
+        return dict(
+            total_wall_seconds=round(time.time() - self.started, 4),
+            peak_rss_bytes=max([stage.peak_rss_bytes for stage in self.stages] + [peak_rss()]),
+            stages=[stage.as_dict() for stage in self.stages],
+        )
+
+    def write(self, filename):
+        with open(filename, 'w') as metricsfile:
+            json.dump(self.as_dict(), metricsfile, indent=2)
+
+    def summary(self):
+        """
+        A line per stage, for printing at the end of a run.
+        """
+        lines = []
+        for stage in self.stages:
+            line = "{:<12} {:>9.1f}s wall {:>9.1f}s CPU {:>8.0f}MB peak".format(
+                stage.name, stage.wall_seconds, stage.cpu_seconds, stage.peak_rss_bytes / 1024.0 / 1024.0)
+            if stage.documents is not None and stage.wall_seconds:
+                line += " {:>10.1f} docs/s".format(stage.documents / stage.wall_seconds)
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class NullMetrics(object):
+    """
+    Stands in for PipelineMetrics when a run isn't being measured.
+    """
+    @contextmanager
+    def stage(self, name, documents=None):
+        yield Stage(name, documents)
+
+
+NO_METRICS = NullMetrics()
+
+
+class ProgressReporter(object):
+    """
+    Report progress through a long list of items at most once every
+    `interval` seconds, instead of once per item.
+    """
+    def __init__(self, description, total=None, interval=5.0, stream=sys.stdout):
+        self.description = description
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.count = 0
+        self.started = time.time()
+        self.last_report = self.started
+
+    def update(self, count=1, item=None):
+        self.count += count
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self._report(now, item)
+
+    def finish(self):
+        self._report(time.time())
+
+    def _report(self, now, item=None):
+        elapsed = now - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+
+        progress = str(self.count)
+        if self.total:
+            progress = "{}/{} ({:.0%})".format(self.count, self.total, float(self.count) / self.total)
+
+        message = "{}: {} at {:.1f}/s".format(self.description, progress, rate)
+        if item is not None:
+            message += ", last {}".format(item)
+
+        print(message, file=self.stream)
+        self.stream.flush()
+
+
+class SamplingProfiler(object):
+    """
+    A low overhead profiler: every `interval` seconds of CPU time, it records
+    the stack of the main thread. Stacks are written in the collapsed format
+    read by flame graph tools, one line per stack with its number of samples.
+
+    It only sees the process it runs in, not worker processes.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = Counter()
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+
+        self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, filename):
+        with open(filename, 'w') as profilefile:
+            for stack, count in self.samples.most_common():
+                profilefile.write('{} {}\n'.format(stack, count))
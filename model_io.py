@@ -1,7 +1,10 @@
 """
 Utilities for importing documents to run LDA on, and exporting the results.
 """
+import cPickle
 import csv
+import json
+import tempfile
 
 
 def load_documents(filename, text_field='text', url_field='url'):
@@ -10,11 +13,49 @@ def load_documents(filename, text_field='text', url_field='url'):
 
     The CSV file should have a column header containing url and text.
     """
+    return list(iter_documents(filename, text_field=text_field, url_field=url_field))
+
+
+def iter_documents(filename, text_field='text', url_field='url'):
+    """
+    Lazily load documents from CSV, one row at a time.
+
+    Use this instead of `load_documents` when the file doesn't fit in memory.
+    """
     with open(filename) as f:
         reader = csv.DictReader(f)
-        raw_documents = list(reader)
+        for doc in reader:
+            if doc[text_field] != '':
+                yield {'base_path': doc[url_field], 'text': doc[text_field]}
 
-    return [{'base_path': doc[url_field], 'text': doc[text_field]} for doc in raw_documents if doc[text_field] != '']
+
+class SpooledMetadata(object):
+    """
+    The metadata of each document, kept in a temporary file rather than in
+    memory, for corpora that are streamed. Metadata is appended a document at
+    a time, and read back in the same order by iterating.
+
+    It's pickled as a plain list, built up one document at a time.
+    """
+    def __init__(self):
+        self.file = tempfile.NamedTemporaryFile(prefix='metadata-')
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        self.file.flush()
+        with open(self.file.name, 'rb') as f:
+            for _ in xrange(self.length):
+                yield cPickle.load(f)
+
+    def __reduce__(self):
+        return (list, (), None, iter(self))
+
+    def append(self, metadata):
+        cPickle.dump(metadata, self.file, cPickle.HIGHEST_PROTOCOL)
+        self.length += 1
 
 
 def export_topics(topics, filename):
@@ -36,3 +77,11 @@ def export_tags(tagged_documents, filename):
         for tagged_document in tagged_documents:
             tag_string = '{},{}\n'.format(tagged_document['base_path'], tagged_document['tags'])
             tagged_documents_file.write(tag_string)
+
+
+def export_evaluation(evaluation, filename):
+    """
+    Export the scores of a model, as computed by `Experiment.evaluate`.
+    """
+    with open(filename, 'w') as evaluation_file:
+        json.dump(evaluation, evaluation_file, indent=2, sort_keys=True)
@@ -4,8 +4,8 @@ import ipdb
 import os
 import lda
 import numpy as np
-
-import lda.utils as lda_utils
+import scipy.sparse
+from collections import Counter
 
 from gensim.utils import lemmatize
 from gensim.parsing.preprocessing import STOPWORDS
@@ -48,40 +48,54 @@ for index, document in enumerate(documents):
     for token in tokens:
         texts.append(token)
 
-tokens_set = set(texts)
+# The column of each token in the document-term matrix
+tokens = sorted(set(texts))
+token_ids = dict((token, token_id) for token_id, token in enumerate(tokens))
 
 print("Writing tokens into output file")
 with open('output/data.tokens', 'w') as f:
-    for token in tokens_set:
+    for token in tokens:
         print(token, file=f)
 
-print("Generating Document-Term Matrix (DTM)")
-dtm = np.empty((len(documents_words), len(tokens_set)), dtype=np.intc)
-tokens_count = len(tokens_set)
 
-for token_index, token in enumerate(tokens_set):
-    print(str(token_index), " of ", str(tokens_count), end='\r')
-    for doc_index, document in enumerate(documents_words):
-        dtm[doc_index, token_index] = document.count(token)
+def sparse_dtm(documents_words, token_ids):
+    """
+    Build a sparse Document-Term Matrix in a single pass over the documents.
+    """
+    indptr = [0]
+    indices = []
+    counts = []
 
-print("Generating LDAC data")
-doclines = list(lda_utils.dtm2ldac(dtm))
+    for document in documents_words:
+        token_counts = Counter(token_ids[token] for token in document)
+        for token_id in sorted(token_counts):
+            indices.append(token_id)
+            counts.append(token_counts[token_id])
+        indptr.append(len(indices))
 
-print("Writing LDAC file")
-with open('output/data.ldac', 'w') as f:
-    for line in doclines:
-        print(line, file=f)
+    return scipy.sparse.csr_matrix(
+        (np.array(counts, dtype=np.intc), np.array(indices, dtype=np.intc), np.array(indptr, dtype=np.intc)),
+        shape=(len(documents_words), len(token_ids))
+    )
 
-def load_govuk_data():
-    ldac_fn = os.path.join('output', 'data.ldac')
-    return lda.utils.ldac2dtm(open(ldac_fn), offset=0)
 
+def dtm_to_ldac(dtm):
+    """
+    Yield each row of a sparse Document-Term Matrix in LDA-C format.
+    """
+    for doc_index in range(dtm.shape[0]):
+        start, end = dtm.indptr[doc_index], dtm.indptr[doc_index + 1]
+        terms = ' '.join('{}:{}'.format(token_id, count) for token_id, count in zip(dtm.indices[start:end], dtm.data[start:end]))
+        yield '{} {}'.format(end - start, terms)
 
-def load_govuk_tokens():
-    tokens_fn = os.path.join('output', 'data.tokens')
-    with open(tokens_fn) as f:
-        tokens = tuple(f.read().split())
-    return tokens
+
+print("Generating Document-Term Matrix (DTM)")
+dtm = sparse_dtm(documents_words, token_ids)
+
+print("Writing LDAC file")
+with open('output/data.ldac', 'w') as f:
+    for line in dtm_to_ldac(dtm):
+        print(line, file=f)
 
 
 def load_govuk_titles():
@@ -90,15 +104,11 @@ def load_govuk_titles():
         titles = tuple(line.strip() for line in f.readlines())
     return titles
 
-print("Loading LDAC")
-X = load_govuk_data()
-print("Loading tokens")
-tokens = load_govuk_tokens()
 print("Loading titles")
 titles = load_govuk_titles()
 
 model = lda.LDA(n_topics=20, n_iter=100, random_state=1)
-model.fit(X)
+model.fit(dtm)
 topic_word = model.topic_word_
 n_top_words = 5
 
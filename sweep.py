@@ -0,0 +1,327 @@
+"""
+Train a grid of LDA experiments on the same documents, for comparing topic
+counts and dictionary filters.
+
+The documents are tokenised once. Each combination of dictionary filters
+and TF-IDF weighting gets its own corpus, built from the shared phrases, and
+every configuration is trained in parallel on the corpus it needs:
+
+    python sweep.py input/early-years.csv --name early-years-sweep --numtopics 10 20 40 --no-below 5 20 --tfidf both
+
+Each configuration is saved as the experiment `<name>/<configuration>`, and
+a summary of the sweep, including each configuration's held-out perplexity
+and topic coherence, is written to experiments/<name>/summary.csv.
+"""
+from __future__ import print_function
+import argparse
+import copy
+import csv
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from itertools import product
+from gensim import corpora, models
+import gensim
+from corpus_building import CorpusReader
+from csr_corpus import CsrCorpus
+from gensim_engine import GensimEngine, Experiment
+from evaluation import CooccurrenceCounts
+from model_io import iter_documents, export_topics, export_tags, export_evaluation
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument(
+    'training_documents', metavar='CSV',
+    help='File containing the training documents'
+)
+parser.add_argument(
+    '--name', dest='name', required=True,
+    help='Name of the sweep. Experiments are saved under experiments/NAME/'
+)
+parser.add_argument(
+    '--numtopics', dest='numbers_of_topics', type=int, nargs='+', default=[20],
+    help='Numbers of topics to train'
+)
+parser.add_argument(
+    '--no-below', dest='no_below', type=int, nargs='+', default=[0],
+    help='Values of the dictionary --no-below filter to try'
+)
+parser.add_argument(
+    '--no-above', dest='no_above', type=float, nargs='+', default=[0.5],
+    help='Values of the dictionary --no-above filter to try'
+)
+parser.add_argument(
+    '--keep-n', dest='keep_n', type=int, default=None,
+    help="Keep this many terms in each dictionary after filtering extremes."
+)
+parser.add_argument(
+    '--tfidf', dest='tfidf', choices=['off', 'on', 'both'], default='off',
+    help='Whether to weight terms by TF-IDF, or try both'
+)
+parser.add_argument(
+    '--workers', dest='workers', type=int, default=multiprocessing.cpu_count(),
+    help='Number of configurations to train at once'
+)
+parser.add_argument(
+    '--preprocess-workers', dest='preprocess_workers', type=int, default=None,
+    help="Extract phrases from the documents using this many worker processes."
+)
+parser.add_argument(
+    '--token-cache', dest='token_cache', metavar='FILENAME', default=None,
+    help="Reuse the phrases extracted from unchanged documents in previous imports, stored in this cache file."
+)
+parser.add_argument(
+    '--words-per-topic', dest='words_per_topic', type=int, default=8,
+    help="Words per topic"
+)
+parser.add_argument(
+    '--passes', dest='passes', type=int, default=50,
+    help="Number of LDA passes"
+)
+parser.add_argument(
+    '--chunksize', dest='chunksize', type=int, default=2000,
+    help="Number of documents in each training chunk"
+)
+parser.add_argument(
+    '--update-every', dest='update_every', type=int, default=1,
+    help="Number of chunks to process before each model update. Use 0 to update once per pass (batch training)."
+)
+parser.add_argument(
+    '--holdout', dest='holdout', type=float, default=0.1,
+    help="Leave this fraction of the documents out of training, to compare the configurations' perplexity on them."
+)
+parser.add_argument(
+    '--convergence-threshold', dest='convergence_threshold', type=float, default=None,
+    help="Stop training a configuration early once passes improve its held-out likelihood by less than this relative amount."
+)
+parser.add_argument(
+    '--patience', dest='patience', type=int, default=2,
+    help="Number of passes in a row below the convergence threshold before stopping"
+)
+parser.add_argument(
+    '--coherence-words', dest='coherence_words', type=int, default=10,
+    help="Number of top words of each topic to measure coherence on"
+)
+parser.add_argument(
+    '--binary', dest='binary', action='store_true',
+    help="Save the experiments in the compact binary format, which loads faster."
+)
+parser.add_argument(
+    '--nobigrams', dest='bigrams', action='store_false',
+    help="Don't include bigrams in the model's vocabulary."
+)
+parser.add_argument(
+    '--use-phrasemachine', dest='use_phrasemachine', action='store_true',
+    help="Use phrasemachine instead of lemmatization when building the dictionary."
+)
+parser.add_argument(
+    '--use-textacy', dest='use_textacy', action='store_true',
+    help='Use textacy to generate bigrams/noun phrases'
+)
+parser.add_argument(
+    '--no-lemmatisation', dest='use_lemmatisation', action='store_false',
+    help='Use lemmatisation to refine input text'
+)
+
+SUMMARY_FIELDS = ['experiment', 'number_of_topics', 'no_below', 'no_above', 'use_tfidf', 'vocabulary_size', 'training_seconds', 'passes_used', 'perplexity', 'u_mass', 'c_v']
+
+
+class Configuration(namedtuple('Configuration', 'number_of_topics no_below no_above use_tfidf')):
+    """
+    One point of the sweep's grid.
+    """
+    @property
+    def corpus_name(self):
+        """
+        Name of the corpus variant this configuration is trained on.
+        Configurations that differ only in their number of topics share it.
+        """
+        name = 'below-{}_above-{}'.format(self.no_below, self.no_above)
+        if self.use_tfidf:
+            name += '_tfidf'
+        return name
+
+    @property
+    def name(self):
+        return 'topics-{}_{}'.format(self.number_of_topics, self.corpus_name)
+
+
+def configurations(numbers_of_topics, no_below_values, no_above_values, tfidf_values):
+    return [Configuration(*values) for values in product(numbers_of_topics, no_below_values, no_above_values, tfidf_values)]
+
+
+def build_corpora(reader, documents, configurations, corpora_path, keep_n=None):
+    """
+    Tokenise the documents once, then build and save the filtered dictionary
+    and corpus of every variant the configurations need.
+
+    Each variant is saved in its own directory under `corpora_path`, along
+    with the document metadata, so that worker processes can load it.
+    """
+    print("Generating lemmas for each of the documents")
+    phrases = []
+    document_metadata = []
+    for document, document_phrases in reader.iter_phrases(documents):
+        phrases.append(document_phrases)
+        document_metadata.append(dict(base_path=document['base_path']))
+
+    full_dictionary = corpora.Dictionary(phrases)
+    variants = dict((configuration.corpus_name, configuration) for configuration in configurations)
+
+    for corpus_name, configuration in sorted(variants.items()):
+        print("Building corpus {}".format(corpus_name))
+        variant_path = os.path.join(corpora_path, corpus_name)
+        if not os.path.exists(variant_path):
+            os.makedirs(variant_path)
+
+        dictionary = copy.deepcopy(full_dictionary)
+        dictionary.filter_extremes(no_below=configuration.no_below, no_above=configuration.no_above, keep_n=keep_n)
+
+        corpus = [dictionary.doc2bow(document_phrases) for document_phrases in phrases]
+        if configuration.use_tfidf:
+            tfidf_model = models.TfidfModel(corpus)
+            tfidf_model.save(os.path.join(variant_path, 'tfidf'))
+            corpus = tfidf_model[corpus]
+
+        # Weighted once here, then reused for the co-occurrence counts
+        corpus = CsrCorpus.from_corpus(corpus)
+        corpus.save(os.path.join(variant_path, 'corpus'))
+        CooccurrenceCounts.from_corpus(corpus, len(dictionary)).save(os.path.join(variant_path, 'cooccurrence.npz'))
+        dictionary.save(os.path.join(variant_path, 'dict.bin'))
+        gensim.utils.pickle(document_metadata, os.path.join(variant_path, 'meta.bin'))
+
+
+def train_configuration(job):
+    """
+    Train and save a single configuration. Runs in a worker process, and
+    returns the configuration's row of the sweep summary.
+    """
+    configuration, corpus_path, experiment_name, reader_options, options = job
+
+    corpus = CsrCorpus.load(os.path.join(corpus_path, 'corpus'))
+    dictionary = corpora.Dictionary.load(os.path.join(corpus_path, 'dict.bin'))
+    document_metadata = gensim.utils.unpickle(os.path.join(corpus_path, 'meta.bin'))
+
+    tfidf_model = None
+    if configuration.use_tfidf:
+        tfidf_model = models.TfidfModel.load(os.path.join(corpus_path, 'tfidf'))
+
+    reader_options = dict(
+        reader_options,
+        no_below=configuration.no_below,
+        no_above=configuration.no_above,
+        use_tfidf=configuration.use_tfidf,
+    )
+    engine = GensimEngine(corpus, dictionary, document_metadata, reader_options=reader_options, tfidf_model=tfidf_model)
+
+    started = time.time()
+    experiment = engine.train(
+        number_of_topics=configuration.number_of_topics,
+        words_per_topic=options['words_per_topic'],
+        passes=options['passes'],
+        chunksize=options['chunksize'],
+        update_every=options['update_every'],
+        holdout=options['holdout'],
+        convergence_threshold=options['convergence_threshold'],
+        patience=options['patience'],
+    )
+    training_seconds = time.time() - started
+
+    experiment_path = os.path.join(Experiment.DEFAULT_EXPERIMENT_PATH, experiment_name)
+    if not os.path.exists(os.path.join(experiment_path, 'models')):
+        os.makedirs(os.path.join(experiment_path, 'models'))
+
+    experiment.save(experiment_name, binary=options['binary'])
+    export_topics(engine.topics, os.path.join(experiment_path, 'topics'))
+    export_tags(experiment.tag(), os.path.join(experiment_path, 'tags'))
+
+    # All the configurations trained on this corpus share its co-occurrence counts
+    evaluation = experiment.evaluate(
+        cooccurrence_filename=os.path.join(corpus_path, 'cooccurrence.npz'),
+        top_words=options['coherence_words'],
+    )
+    evaluation['training'] = engine.training_report
+    export_evaluation(evaluation, os.path.join(experiment_path, 'evaluation.json'))
+
+    return dict(
+        configuration._asdict(),
+        experiment=experiment_name,
+        vocabulary_size=len(dictionary),
+        training_seconds=round(training_seconds, 1),
+        passes_used=engine.training_report['passes_used'],
+        perplexity=evaluation['perplexity'],
+        u_mass=evaluation['u_mass'],
+        c_v=evaluation['c_v'],
+    )
+
+
+def run_sweep(name, documents, reader, configurations, workers=None, keep_n=None, **options):
+    """
+    Train every configuration on the documents, and write a summary of the
+    results to experiments/`name`/summary.csv. Returns the summary rows.
+    """
+    sweep_path = os.path.join(Experiment.DEFAULT_EXPERIMENT_PATH, name)
+    corpora_path = os.path.join(sweep_path, 'corpora')
+    build_corpora(reader, documents, configurations, corpora_path, keep_n=keep_n)
+
+    jobs = [
+        (configuration, os.path.join(corpora_path, configuration.corpus_name), os.path.join(name, configuration.name), reader.options(), options)
+        for configuration in configurations
+    ]
+
+    print("Training {} configurations using {} workers".format(len(jobs), workers))
+    pool = multiprocessing.Pool(workers)
+    summary = []
+    try:
+        for row in pool.imap_unordered(train_configuration, jobs):
+            print("Finished {}".format(row['experiment']))
+            summary.append(row)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    summary.sort(key=lambda row: row['experiment'])
+    with open(os.path.join(sweep_path, 'summary.csv'), 'wb') as summary_file:
+        writer = csv.DictWriter(summary_file, SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summary)
+
+    return summary
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    tfidf_values = {'off': [False], 'on': [True], 'both': [False, True]}[args.tfidf]
+    sweep_configurations = configurations(args.numbers_of_topics, args.no_below, args.no_above, tfidf_values)
+
+    reader = CorpusReader(
+        include_bigrams=args.bigrams,
+        use_phrasemachine=args.use_phrasemachine,
+        use_textacy=args.use_textacy,
+        use_lemmatisation=args.use_lemmatisation,
+        keep_n=args.keep_n,
+        workers=args.preprocess_workers,
+        token_cache=args.token_cache,
+    )
+
+    print("Streaming input file {}".format(args.training_documents))
+    run_sweep(
+        args.name,
+        iter_documents(args.training_documents),
+        reader,
+        sweep_configurations,
+        workers=args.workers,
+        keep_n=args.keep_n,
+        words_per_topic=args.words_per_topic,
+        passes=args.passes,
+        chunksize=args.chunksize,
+        update_every=args.update_every,
+        binary=args.binary,
+        holdout=args.holdout,
+        convergence_threshold=args.convergence_threshold,
+        patience=args.patience,
+        coherence_words=args.coherence_words,
+    )
+
+    print("Summary written to {}".format(os.path.join(Experiment.DEFAULT_EXPERIMENT_PATH, args.name, 'summary.csv')))
@@ -0,0 +1,248 @@
+"""
+Serve tags for new documents from a trained experiment, without retraining.
+
+The experiment is loaded once. POST a JSON document, or a list of documents,
+each with `base_path` and `text` keys, to /tag:
+
+    curl -d '{"base_path": "/foo", "text": "Early years funding"}' http://localhost:8000/tag
+
+The response lists the top topics of each document as [topic_id, probability]
+pairs. Documents from concurrent requests are tagged together in small batches.
+"""
+from __future__ import print_function
+import argparse
+import json
+import Queue
+import threading
+import time
+import traceback
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from corpus_building import CorpusReader
+from gensim_engine import Experiment
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument(
+    'experiment', metavar='EXPERIMENT',
+    help='Name of a previous experiment, eg 2016-11-01_15-44-06_695357'
+)
+parser.add_argument(
+    '--host', dest='host', default='localhost',
+    help='Interface to listen on'
+)
+parser.add_argument(
+    '--port', dest='port', type=int, default=8000,
+    help='Port to listen on'
+)
+parser.add_argument(
+    '--top-topics', dest='top_topics', type=int, default=3,
+    help='Number of topics to return for each document'
+)
+parser.add_argument(
+    '--max-batch-size', dest='max_batch_size', type=int, default=64,
+    help='Maximum number of documents to tag together'
+)
+parser.add_argument(
+    '--max-wait', dest='max_wait', type=float, default=0.01,
+    help='Seconds to wait for more documents before tagging a batch'
+)
+
+# Only used for experiments saved before the reader options were recorded
+parser.add_argument(
+    '--nobigrams', dest='include_bigrams', action='store_false',
+    help="The experiment doesn't include bigrams in its vocabulary."
+)
+parser.add_argument(
+    '--use-phrasemachine', dest='use_phrasemachine', action='store_true',
+    help="The experiment used phrasemachine to build the dictionary."
+)
+parser.add_argument(
+    '--use-textacy', dest='use_textacy', action='store_true',
+    help='The experiment used textacy to generate bigrams/noun phrases'
+)
+parser.add_argument(
+    '--no-lemmatisation', dest='use_lemmatisation', action='store_false',
+    help="The experiment didn't use lemmatisation"
+)
+
+
+class PendingRequest(object):
+    """
+    Documents from a single request, waiting to be tagged.
+    """
+    def __init__(self, bows):
+        self.bows = bows
+        self.tags = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """
+    Collect the documents of concurrent requests and run inference on them
+    together, in one call to the model.
+
+    A batch is tagged once it has `max_batch_size` documents, or `max_wait`
+    seconds after its first request arrived.
+    """
+    def __init__(self, experiment, top_topics=3, max_batch_size=64, max_wait=0.01):
+        self.experiment = experiment
+        self.top_topics = top_topics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = Queue.Queue()
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def tag(self, bows):
+        """
+        Tag a list of bag of words documents, blocking until they're done.
+        """
+        request = PendingRequest(bows)
+        self.queue.put(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+
+        return request.tags
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            batch_size = len(batch[0].bows)
+            deadline = time.time() + self.max_wait
+
+            while batch_size < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=remaining)
+                except Queue.Empty:
+                    break
+                batch.append(request)
+                batch_size += len(request.bows)
+
+            self._tag_batch(batch)
+
+    def _tag_batch(self, batch):
+        bows = [bow for request in batch for bow in request.bows]
+
+        try:
+            doc_topics = self.experiment.infer_topics(bows, chunksize=max(len(bows), 1))
+            tags = Experiment.top_topics(doc_topics, self.top_topics)
+
+            start = 0
+            for request in batch:
+                request.tags = tags[start:start + len(request.bows)]
+                start += len(request.bows)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
+
+
+class TaggingService(object):
+    """
+    Turn raw documents into bags of words the same way as the training
+    corpus, weighed by TF-IDF if the corpus was, and tag them with the
+    experiment's model.
+    """
+    def __init__(self, experiment, reader, batcher):
+        self.experiment = experiment
+        self.reader = reader
+        self.batcher = batcher
+
+    def tag_documents(self, documents):
+        bows = []
+        for document in documents:
+            phrases = self.reader.text_phrases(document['text'].encode('utf8'))
+            bows.append(self.experiment.dictionary.doc2bow(phrases))
+
+        tags = self.batcher.tag(self.experiment.weigh(bows))
+
+        return [
+            {'base_path': document.get('base_path'), 'tags': document_tags}
+            for document, document_tags in zip(documents, tags)
+        ]
+
+
+class TaggingRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/tag':
+            self.send_error(404)
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+            documents = body if isinstance(body, list) else [body]
+            if not all(isinstance(document, dict) and 'text' in document for document in documents):
+                raise ValueError('Each document should have a "text" key')
+            if not all(isinstance(document['text'], basestring) for document in documents):
+                raise ValueError('The "text" of each document should be a string')
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        # Anything else that goes wrong while tagging is reported to the
+        # client, rather than dropping the connection without a response
+        try:
+            tagged_documents = self.server.service.tag_documents(documents)
+        except Exception as e:
+            self.log_error("Error tagging documents: %s", traceback.format_exc())
+            self._send_json(500, {'error': "{}: {}".format(type(e).__name__, e)})
+            return
+
+        self._send_json(200, tagged_documents if isinstance(body, list) else tagged_documents[0])
+
+    def _send_json(self, status, value):
+        response = json.dumps(value)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+class TaggingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, TaggingRequestHandler)
+        self.service = service
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    print("Loading experiment {}".format(args.experiment))
+    experiment = Experiment.load(args.experiment, lazy=True)
+
+    reader_options = experiment.reader_options
+    if reader_options is None:
+        reader_options = dict(
+            include_bigrams=args.include_bigrams,
+            use_phrasemachine=args.use_phrasemachine,
+            use_textacy=args.use_textacy,
+            use_lemmatisation=args.use_lemmatisation,
+        )
+
+    if reader_options.get('use_tfidf') and experiment.tfidf_model is None:
+        parser.error("The experiment was saved without its TF-IDF model. Retrain it to tag new documents.")
+
+    reader = CorpusReader(**reader_options)
+    batcher = MicroBatcher(
+        experiment,
+        top_topics=args.top_topics,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait,
+    )
+    server = TaggingServer((args.host, args.port), TaggingService(experiment, reader, batcher))
+
+    print("Serving tags on http://{}:{}/tag".format(args.host, args.port))
+    server.serve_forever()
@@ -0,0 +1,136 @@
+"""
+On-disk cache of the phrases extracted from each document, so that
+experiments on the same documents don't have to tokenise them again.
+"""
+import hashlib
+import json
+import marshal
+import sqlite3
+import time
+
+# Bump this when a change to the tokenisation code invalidates cached phrases
+CACHE_VERSION = 1
+
+# Maximum number of SQL variables in a single sqlite query
+SQLITE_MAX_VARIABLES = 900
+
+
+class TokenCache(object):
+    """
+    Cache the phrases of documents, keyed by a hash of the document text and
+    the options used to extract the phrases.
+
+    Entries are stored in a sqlite database. When the cache grows beyond
+    `max_size` bytes, the least recently used entries are evicted. The total
+    size is counted once when the cache is opened and kept up to date as
+    entries are stored, so entries stored by other processes meanwhile are
+    only counted next time.
+    """
+    def __init__(self, filename, options, max_size=1024 * 1024 * 1024):
+        self.filename = filename
+        self.max_size = max_size
+        self.namespace = json.dumps(dict(options, cache_version=CACHE_VERSION), sort_keys=True)
+
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS phrases '
+            '(key TEXT PRIMARY KEY, phrases BLOB, size INTEGER, last_used REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS phrases_last_used ON phrases (last_used)')
+        self.connection.commit()
+
+        self.total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM phrases').fetchone()[0]
+
+    def key(self, text):
+        """
+        Hash a utf8 encoded document text together with the cache options.
+        """
+        return hashlib.sha1(self.namespace + '\0' + text).hexdigest()
+
+    def lookup(self, texts):
+        """
+        Return the cached phrases of each text, or None if it's not cached.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+
+        for key_chunk in _chunks(list(set(keys)), SQLITE_MAX_VARIABLES):
+            placeholders = ','.join('?' * len(key_chunk))
+            rows = self.connection.execute(
+                'SELECT key, phrases FROM phrases WHERE key IN ({})'.format(placeholders),
+                key_chunk
+            )
+            for key, phrases in rows:
+                found[key] = marshal.loads(str(phrases))
+
+            self.connection.execute(
+                'UPDATE phrases SET last_used = ? WHERE key IN ({})'.format(placeholders),
+                [time.time()] + key_chunk
+            )
+
+        self.connection.commit()
+        return [found.get(key) for key in keys]
+
+    def store(self, texts, phrases):
+        """
+        Cache the phrases of each text, evicting old entries if the cache is
+        over its size limit.
+        """
+        now = time.time()
+        rows = {}
+        for text, document_phrases in zip(texts, phrases):
+            blob = marshal.dumps(document_phrases)
+            key = self.key(text)
+            rows[key] = (key, sqlite3.Binary(blob), len(blob), now)
+
+        # Entries that are replaced no longer count towards the total
+        for key_chunk in _chunks(list(rows), SQLITE_MAX_VARIABLES):
+            placeholders = ','.join('?' * len(key_chunk))
+            for (replaced_size,) in self.connection.execute(
+                'SELECT size FROM phrases WHERE key IN ({})'.format(placeholders),
+                key_chunk
+            ):
+                self.total_size -= replaced_size
+
+        self.connection.executemany('INSERT OR REPLACE INTO phrases VALUES (?, ?, ?, ?)', rows.values())
+        self.connection.commit()
+        self.total_size += sum(row[2] for row in rows.values())
+        self.evict()
+
+    def size(self):
+        """
+        Total size of the cached phrases, in bytes.
+        """
+        return self.total_size
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is back under
+        90% of its size limit.
+        """
+        size = self.size()
+        if size <= self.max_size:
+            return
+
+        target = self.max_size * 0.9
+        evicted = []
+        for key, entry_size in self.connection.execute('SELECT key, size FROM phrases ORDER BY last_used'):
+            if size <= target:
+                break
+            evicted.append(key)
+            size -= entry_size
+
+        for key_chunk in _chunks(evicted, SQLITE_MAX_VARIABLES):
+            placeholders = ','.join('?' * len(key_chunk))
+            self.connection.execute('DELETE FROM phrases WHERE key IN ({})'.format(placeholders), key_chunk)
+
+        self.connection.commit()
+        self.total_size = size
+
+    def close(self):
+        self.connection.close()
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
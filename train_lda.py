@@ -6,7 +6,8 @@ import argparse
 import datetime
 import os
 from gensim_engine import GensimEngine
-from model_io import load_documents, export_topics, export_tags
+from instrumentation import PipelineMetrics, SamplingProfiler
+from model_io import load_documents, export_topics, export_tags, export_evaluation
 
 parser = argparse.ArgumentParser(description=__doc__)
 subparsers = parser.add_subparsers(help='sub-commands')
@@ -25,21 +26,44 @@ import_parser.add_argument(
     '--input-dictionary', dest='dictionary', metavar='DICTIONARY',
     help='A curated dictionary file. If not specified, the dictionary will be generated from the training documents.'
 )
+# Refining with --update also uses these for experiments saved before the
+# reader options were recorded
+for subparser in (import_parser, refine_parser):
+    subparser.add_argument(
+        '--nobigrams', dest='bigrams', action='store_false',
+        help="Don't include bigrams in the model's vocabulary."
+    )
+    subparser.add_argument(
+        '--no-below', dest='no_below', type=int, default=0,
+        help="Filter out words that occur less than this number of times in the corpus."
+    )
+    subparser.add_argument(
+        '--no-above', dest='no_above', type=float, default=0.5,
+        help="Filter out words that make up more than this fraction of the corpus."
+    )
+    subparser.add_argument(
+        '--keep-n', dest='keep_n', type=int, default=None,
+        help="Keep this many terms in the dictionary after filtering extremes."
+    )
 import_parser.add_argument(
-    '--nobigrams', dest='bigrams', action='store_false',
-    help="Don't include bigrams in the model's vocabulary."
+    '--preprocess-workers', dest='preprocess_workers', type=int, default=None,
+    help="Extract phrases from the documents using this many worker processes."
 )
 import_parser.add_argument(
-    '--no-below', dest='no_below', type=int, default=0,
-    help="Filter out words that occur less than this number of times in the corpus."
+    '--token-cache', dest='token_cache', metavar='FILENAME', default=None,
+    help="Reuse the phrases extracted from unchanged documents in previous imports, stored in this cache file."
 )
 import_parser.add_argument(
-    '--no-above', dest='no_above', type=float, default=0.5,
-    help="Filter out words that make up more than this fraction of the corpus."
+    '--token-cache-size', dest='token_cache_size', type=int, default=1024,
+    help="Maximum size of the token cache in megabytes. The least recently used documents are evicted first."
 )
 import_parser.add_argument(
-    '--keep-n', dest='keep_n', type=int, default=None,
-    help="Keep this many terms in the dictionary after filtering extremes."
+    '--streaming', dest='streaming', action='store_true',
+    help="Stream the documents from the CSV file and write the corpus straight to disk, for inputs that don't fit in memory."
+)
+import_parser.add_argument(
+    '--lazy-tfidf', dest='lazy_tfidf', action='store_true',
+    help="With --use-tfidf, compute the TF-IDF weights each time the corpus is read instead of storing the weighted corpus. Uses less memory but trains more slowly."
 )
 import_parser.add_argument(
     '--experiment', dest='experiment', default=None,
@@ -49,6 +73,26 @@ refine_parser.add_argument(
     'experiment', metavar='EXPERIMENT',
     help='Name of a previous experiment, eg 2016-11-01_15-44-06_695357'
 )
+refine_parser.add_argument(
+    '--update', dest='update_documents', metavar='CSV', default=None,
+    help="Add new or changed documents from this file and update the existing model with them, instead of retraining it."
+)
+refine_parser.add_argument(
+    '--new-terms', dest='new_terms', choices=['freeze', 'extend'], default='freeze',
+    help="With 'freeze', terms that aren't in the dictionary are ignored. With 'extend', common new terms are added to it."
+)
+refine_parser.add_argument(
+    '--max-new-terms', dest='max_new_terms', type=int, default=1000,
+    help="Maximum number of terms to add to the dictionary when extending it."
+)
+refine_parser.add_argument(
+    '--min-new-term-count', dest='min_new_term_count', type=int, default=2,
+    help="Only add new terms that appear in at least this many of the updated documents."
+)
+refine_parser.add_argument(
+    '--update-passes', dest='update_passes', type=int, default=1,
+    help="Number of passes over the updated documents."
+)
 
 
 parser.add_argument(
@@ -60,6 +104,16 @@ parser.add_argument(
     help='Save tagged documents to a file.'
 )
 
+parser.add_argument(
+    '--output-evaluation', dest='evaluation_filename', metavar='FILENAME', default=None,
+    help='Save the perplexity and coherence scores to a file. Defaults to evaluation.json next to the topics file.'
+)
+
+parser.add_argument(
+    '--output-doc-topics', dest='doc_topics_filename', metavar='FILENAME', default=None,
+    help='Save the topic distribution of every document to a NumPy .npy file.'
+)
+
 parser.add_argument(
     '--numtopics', dest='number_of_topics', type=int, default=20,
     help="Number of topics to train"
@@ -72,6 +126,42 @@ parser.add_argument(
     '--passes', dest='passes', type=int, default=50,
     help="Number of LDA passes"
 )
+parser.add_argument(
+    '--workers', dest='workers', type=int, default=None,
+    help="Train the model in parallel using this many worker processes. Defaults to single-threaded training."
+)
+parser.add_argument(
+    '--chunksize', dest='chunksize', type=int, default=2000,
+    help="Number of documents in each training chunk"
+)
+parser.add_argument(
+    '--update-every', dest='update_every', type=int, default=1,
+    help="Number of chunks to process before each model update. Use 0 to update once per pass (batch training)."
+)
+parser.add_argument(
+    '--holdout', dest='holdout', type=float, default=0.0,
+    help="Leave this fraction of the documents out of training, to measure the model's perplexity on them."
+)
+parser.add_argument(
+    '--convergence-threshold', dest='convergence_threshold', type=float, default=None,
+    help="Stop training early once passes improve the model by less than this. With --holdout, improvement is the relative change in held-out likelihood; otherwise it's how far the topics moved."
+)
+parser.add_argument(
+    '--patience', dest='patience', type=int, default=2,
+    help="Number of passes in a row below the convergence threshold before stopping"
+)
+parser.add_argument(
+    '--checkpoint-every', dest='checkpoint_every', type=int, default=None,
+    help="Save a checkpoint of the model every N passes. Running the same command again resumes from it."
+)
+parser.add_argument(
+    '--coherence-words', dest='coherence_words', type=int, default=10,
+    help="Number of top words of each topic to measure coherence on"
+)
+parser.add_argument(
+    '--binary', dest='binary', action='store_true',
+    help="Save the experiment in the compact binary format, which loads faster."
+)
 parser.add_argument(
     '--vis-filename', dest='vis_filename', metavar='FILENAME', default=None,
     help="Save visualisation of the topics to a file."
@@ -92,6 +182,14 @@ parser.add_argument(
     '--use-tfidf', dest='use_tfidf', action='store_true',
     help="Weight terms in a document according to TF-IDF."
 )
+parser.add_argument(
+    '--profile', dest='profile_filename', metavar='FILENAME', default=None,
+    help="Sample where the run spends its CPU time, and save the stacks to a file in the collapsed format read by flame graph tools."
+)
+parser.add_argument(
+    '--profile-interval', dest='profile_interval', type=float, default=0.01,
+    help="Seconds of CPU time between profiler samples"
+)
 
 if __name__ == '__main__':
     args = parser.parse_args()
@@ -101,47 +199,151 @@ if __name__ == '__main__':
         experiment_name = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')
 
     experiment_path = os.path.join('experiments', experiment_name)
+    checkpoint_filename = os.path.join(experiment_path, 'models', 'checkpoint') if args.checkpoint_every else None
+
+    metrics = PipelineMetrics()
+    profiler = None
+    if args.profile_filename:
+        profiler = SamplingProfiler(interval=args.profile_interval)
+        profiler.start()
+
+    # The options that decide how documents are turned into a corpus
+    reader_options = dict(
+        include_bigrams=args.bigrams,
+        use_phrasemachine=args.use_phrasemachine,
+        use_textacy=args.use_textacy,
+        use_lemmatisation=args.use_lemmatisation,
+        use_tfidf=args.use_tfidf,
+        no_below=args.no_below,
+        no_above=args.no_above,
+        keep_n=args.keep_n,
+    )
+
+    try:
+        if args.command == 'import':
+            # An existing experiment is only reused to resume a checkpointed
+            # run. Anything else would overwrite it.
+            if checkpoint_filename is not None and os.path.exists(checkpoint_filename + '.json'):
+                print("Resuming experiment {} from its checkpoint".format(experiment_name))
+            else:
+                os.makedirs(os.path.join(experiment_path, 'models'))
+
+            corpus_options = dict(
+                reader_options,
+                dictionary_path=args.dictionary,
+                workers=args.preprocess_workers,
+                token_cache=args.token_cache,
+                token_cache_size=args.token_cache_size * 1024 * 1024,
+                lazy_tfidf=args.lazy_tfidf,
+                metrics=metrics,
+            )
+
+            if args.streaming:
+                # Reading the file is part of the tokenise stage
+                print("Streaming input file {}".format(args.training_documents))
+                corpus_filename = os.path.join(experiment_path, 'models', 'corpus')
+                engine = GensimEngine.from_csv(args.training_documents, corpus_filename, log=True, **corpus_options)
+            else:
+                print("Loading input file {}".format(args.training_documents))
+                with metrics.stage('load') as stage:
+                    training_documents = load_documents(args.training_documents)
+                    stage.documents = len(training_documents)
+                engine = GensimEngine.from_documents(training_documents, log=True, **corpus_options)
+
+        else:
+            print("Loading experiment {}".format(experiment_name))
+            updating = args.update_documents is not None
+            # Retraining reads the whole corpus on every pass, so it's loaded
+            # into memory once rather than parsed from the corpus file each time
+            with metrics.stage('load') as stage:
+                engine = GensimEngine.from_experiment(experiment_name, log=True, lazy=updating, trainable=updating)
+                stage.documents = len(engine.document_metadata)
+
+        if args.command == 'refine' and updating:
+            # Experiments saved before the reader options were recorded
+            if engine.reader_options is None:
+                engine.reader_options = reader_options
+
+            print("Updating with documents from {}".format(args.update_documents))
+            with metrics.stage('load') as stage:
+                update_documents = load_documents(args.update_documents)
+                stage.documents = len(update_documents)
+
+            with metrics.stage('train', documents=len(update_documents) * args.update_passes):
+                experiment = engine.update(
+                    update_documents,
+                    new_terms=args.new_terms,
+                    max_new_terms=args.max_new_terms,
+                    min_new_term_count=args.min_new_term_count,
+                    passes=args.update_passes,
+                    chunksize=args.chunksize,
+                    words_per_topic=args.words_per_topic,
+                )
+        else:
+            print("Training...")
+            with metrics.stage('train') as stage:
+                experiment = engine.train(
+                    number_of_topics=args.number_of_topics,
+                    words_per_topic=args.words_per_topic,
+                    passes=args.passes,
+                    workers=args.workers,
+                    chunksize=args.chunksize,
+                    update_every=args.update_every,
+                    holdout=args.holdout,
+                    convergence_threshold=args.convergence_threshold,
+                    patience=args.patience,
+                    checkpoint_filename=checkpoint_filename,
+                    checkpoint_every=args.checkpoint_every,
+                )
+                # Each pass reads every document
+                stage.documents = len(engine.document_metadata) * engine.training_report['passes_used']
+
+        number_of_documents = len(experiment.document_metadata)
+        topics_filename = args.topics_filename or os.path.join(experiment_path, 'topics')
+        evaluation_filename = args.evaluation_filename or os.path.join(os.path.dirname(topics_filename), 'evaluation.json')
+        tags_filename = args.tags_filename or os.path.join(experiment_path, 'tags')
+
+        print('Saving experiment: {}'.format(experiment_name))
+        with metrics.stage('save', documents=number_of_documents):
+            experiment.save(experiment_name, binary=args.binary)
+
+        with metrics.stage('evaluate', documents=number_of_documents):
+            cooccurrence_filename = os.path.join(experiment_path, 'models', 'cooccurrence.npz')
+            evaluation = experiment.evaluate(cooccurrence_filename=cooccurrence_filename, top_words=args.coherence_words)
+            evaluation['training'] = engine.training_report
+
+        with metrics.stage('tag', documents=number_of_documents):
+            tags = experiment.tag()
+
+        with metrics.stage('export', documents=number_of_documents):
+            print("Exporting topics to {}".format(topics_filename))
+            export_topics(engine.topics, topics_filename)
+
+            print("Exporting evaluation to {}".format(evaluation_filename))
+            export_evaluation(evaluation, evaluation_filename)
+
+            print("Exporting tags to {}".format(tags_filename))
+            export_tags(tags, tags_filename)
+
+            if args.doc_topics_filename:
+                print("Exporting document topics to {}".format(args.doc_topics_filename))
+                experiment.save_document_topics(args.doc_topics_filename)
+
+        vis_filename = args.vis_filename or os.path.join(experiment_path, 'vis.html')
+        print("Exporting visualisation to {}".format(vis_filename))
+        with metrics.stage('visualise', documents=number_of_documents):
+            experiment.visualise(vis_filename)
+
+    finally:
+        # Write the measurements even if a stage failed, to show how far the run got
+        if profiler is not None:
+            profiler.stop()
+            print("Writing profile to {}".format(args.profile_filename))
+            profiler.write(args.profile_filename)
+
+        if os.path.isdir(experiment_path):
+            metrics_filename = os.path.join(experiment_path, 'metrics.json')
+            print("Writing metrics to {}".format(metrics_filename))
+            metrics.write(metrics_filename)
 
-    if args.command == 'import':
-        os.makedirs(experiment_path)
-        os.makedirs(os.path.join(experiment_path, 'models'))
-
-        print("Loading input file {}".format(args.training_documents))
-        training_documents = load_documents(args.training_documents)
-
-        engine = GensimEngine.from_documents(
-            training_documents,
-            log=True,
-            dictionary_path=args.dictionary,
-            include_bigrams=args.bigrams,
-            use_phrasemachine=args.use_phrasemachine,
-            use_textacy=args.use_textacy,
-            use_lemmatisation=args.use_lemmatisation,
-            use_tfidf=args.use_tfidf,
-            no_below=args.no_below,
-            no_above=args.no_above,
-            keep_n=args.keep_n,
-        )
-
-    else:
-        print("Loading experiment {}".format(experiment_name))
-        engine = GensimEngine.from_experiment(experiment_name, log=True)
-
-    print("Training...")
-    experiment = engine.train(number_of_topics=args.number_of_topics, words_per_topic=args.words_per_topic, passes=args.passes)
-
-    print('Saving experiment: {}'.format(experiment_name))
-    experiment.save(experiment_name)
-
-    topics_filename = args.topics_filename or os.path.join(experiment_path, 'topics')
-    print("Exporting topics to {}".format(topics_filename))
-    export_topics(engine.topics, topics_filename)
-
-    tags_filename = args.tags_filename or os.path.join(experiment_path, 'tags')
-    print("Exporting tags to {}".format(tags_filename))
-    tags = experiment.tag()
-    export_tags(tags, tags_filename)
-
-    vis_filename = args.vis_filename or os.path.join(experiment_path, 'vis.html')
-    print("Exporting visualisation to {}".format(vis_filename))
-    experiment.visualise(vis_filename)
+        print(metrics.summary())
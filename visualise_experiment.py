@@ -0,0 +1,44 @@
+"""
+Draw the pyLDAvis visualisation of a saved experiment again, optionally with
+different parameters.
+
+The data behind the visualisation is cached in the experiment's models
+directory, so drawing it again doesn't rerun inference on the corpus.
+"""
+from __future__ import print_function
+import argparse
+import os
+from gensim_engine import Experiment
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    'experiment', metavar='EXPERIMENT',
+    help='Name of a previous experiment, eg 2016-11-01_15-44-06_695357'
+)
+parser.add_argument(
+    '--vis-filename', dest='vis_filename', metavar='FILENAME', default=None,
+    help="File to save the visualisation to. Defaults to vis.html in the experiment's directory."
+)
+parser.add_argument(
+    '--relevant-terms', dest='relevant_terms', type=int, default=30,
+    help='Number of terms to show for each topic'
+)
+parser.add_argument(
+    '--lambda-step', dest='lambda_step', type=float, default=0.01,
+    help='Step size of the relevance slider'
+)
+parser.add_argument(
+    '--mds', dest='mds', choices=['pcoa', 'mmds', 'tsne'], default='pcoa',
+    help='Method used to lay the topics out'
+)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    print("Loading experiment {}".format(args.experiment))
+    experiment = Experiment.load(args.experiment, lazy=True)
+
+    vis_filename = args.vis_filename or os.path.join(Experiment.DEFAULT_EXPERIMENT_PATH, args.experiment, 'vis.html')
+    print("Exporting visualisation to {}".format(vis_filename))
+    experiment.visualise(vis_filename, relevant_terms=args.relevant_terms, lambda_step=args.lambda_step, mds=args.mds)